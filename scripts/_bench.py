@@ -0,0 +1,129 @@
+"""Helpers shared by the benchmark scripts.
+
+The scripts are run with the Python of a QGIS installation from the root
+of a checkout with the ngw_api submodule, e.g.
+
+    python3 scripts/bench_resource_index.py
+
+The plugin sources are imported as the "src" package.
+"""
+import importlib
+import os
+import resource
+import sys
+import time
+from types import SimpleNamespace
+
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_app = None
+
+
+def start_qgis():
+    """Create the QGIS application once, without a display."""
+    global _app
+    if _app is not None:
+        return _app
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from qgis.core import QgsApplication
+
+    _app = QgsApplication([], True)
+    _app.initQgis()
+    return _app
+
+
+def plugin_module(name):
+    """Import a plugin module, e.g. plugin_module("tree_widget.model")."""
+    if ROOT_DIR not in sys.path:
+        sys.path.insert(0, ROOT_DIR)
+    return importlib.import_module("src." + name)
+
+
+def fake_resource(resource_id, display_name, is_group=False, children_count=None):
+    """Return an object with the attributes the tree items read.
+
+    Items and the model only read these attributes, so resources are not
+    requested from a server.
+    """
+    core = plugin_module("ngw_api.core")
+    if is_group:
+        type_id = core.NGWGroupResource.type_id
+    else:
+        type_id = core.NGWVectorLayer.type_id
+    return SimpleNamespace(
+        common=SimpleNamespace(
+            id=resource_id, display_name=display_name, children=is_group
+        ),
+        type_id=type_id,
+        icon_path=os.path.join(ROOT_DIR, "src", "icon.png"),
+        children_count=children_count,
+    )
+
+
+def build_model(groups, resources_per_group):
+    """Return a model with a root group holding groups of resources.
+
+    The tree holds 1 + groups * (resources_per_group + 1) resources.
+    """
+    start_qgis()
+    model_module = plugin_module("tree_widget.model")
+    QModelIndex = model_module.QModelIndex
+
+    model = model_module.QNGWResourceTreeModelBase(None)
+    model.addNGWResourcesToTree(
+        QModelIndex(), [fake_resource(0, "Main resource group", True, groups)]
+    )
+    root_index = model.index(0, 0, QModelIndex())
+
+    next_id = 1
+    group_resources = []
+    for i in range(groups):
+        group_resources.append(
+            fake_resource(next_id, "Group {:05d}".format(i), True, resources_per_group)
+        )
+        next_id += 1
+    model.addNGWResourcesToTree(root_index, group_resources)
+
+    for row in range(groups):
+        group_index = model.index(row, 0, root_index)
+        layers = []
+        for i in range(resources_per_group):
+            layers.append(fake_resource(next_id, "Layer {:07d}".format(i)))
+            next_id += 1
+        model.addNGWResourcesToTree(group_index, layers)
+
+    return model, next_id
+
+
+def best_time(function, repeat=5):
+    """Return the best wall time of several runs, in seconds."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def current_rss():
+    """Return the resident set size of the process in bytes."""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return peak_rss()
+
+
+def peak_rss():
+    """Return the peak resident set size of the process in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS reports bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def megabytes(size):
+    return "{:.1f} MB".format(size / 1024 / 1024)
@@ -0,0 +1,97 @@
+"""Memory benchmark of tree items for a large number of resources.
+
+The __slots__ items of the plugin are compared with items built on
+QTreeWidgetItem with an icon per item, as they were before. Every variant
+is measured in its own process, the growth of the resident set size is
+reported while resources themselves are already allocated.
+"""
+import argparse
+import subprocess
+import sys
+
+from _bench import current_rss, fake_resource, megabytes, plugin_module, start_qgis
+
+
+VARIANTS = ("slots", "qtreewidgetitem")
+
+
+def legacy_item_class():
+    from qgis.PyQt.QtGui import QIcon
+    from qgis.PyQt.QtWidgets import QTreeWidgetItem
+
+    class LegacyItem(QTreeWidgetItem):
+        def __init__(self, ngw_resource):
+            super().__init__()
+            self._locked = False
+            self._row = 0
+            self._children_rows_valid = True
+            self._title = ngw_resource.common.display_name
+            self._ngw_resource = ngw_resource
+            self._icon = QIcon(ngw_resource.icon_path)
+
+    return LegacyItem
+
+
+def build_items(variant, group_resources, layer_resources):
+    if variant == "slots":
+        item_module = plugin_module("tree_widget.item")
+        root_item = item_module.QModelItem()
+        item_class = item_module.QNGWResourceItem
+    else:
+        item_class = legacy_item_class()
+        root_item = item_class(group_resources[0])
+
+    layers_per_group = len(layer_resources) // len(group_resources)
+    for i, group_resource in enumerate(group_resources):
+        group_item = item_class(group_resource)
+        root_item.addChild(group_item)
+        first = i * layers_per_group
+        for layer_resource in layer_resources[first:first + layers_per_group]:
+            group_item.addChild(item_class(layer_resource))
+    return root_item
+
+
+def measure(variant, groups, resources_per_group):
+    start_qgis()
+    group_resources = [
+        fake_resource(i, "Group {:05d}".format(i), True) for i in range(groups)
+    ]
+    layer_resources = [
+        fake_resource(groups + i, "Layer {:07d}".format(i))
+        for i in range(groups * resources_per_group)
+    ]
+    items_count = len(group_resources) + len(layer_resources)
+
+    rss_before = current_rss()
+    root_item = build_items(variant, group_resources, layer_resources)
+    rss_after = current_rss()
+    assert root_item.childCount() == groups
+
+    growth = rss_after - rss_before
+    print("{:16} {:>9} items {:>10} {:8.0f} bytes per item".format(
+        variant, items_count, megabytes(growth), growth / items_count
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--resources-per-group", type=int, default=1000)
+    parser.add_argument("--variant", choices=VARIANTS)
+    args = parser.parse_args()
+
+    if args.variant is not None:
+        measure(args.variant, args.groups, args.resources_per_group)
+        return
+
+    for variant in VARIANTS:
+        subprocess.run([
+            sys.executable, __file__,
+            "--groups", str(args.groups),
+            "--resources-per-group", str(args.resources_per_group),
+            "--variant", variant,
+        ], check=True)
+
+
+if __name__ == "__main__":
+    main()
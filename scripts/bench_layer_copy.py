@@ -0,0 +1,109 @@
+"""Benchmark of reading vector layer data for a copy.
+
+Layer copy used to read the GeoJSON of a layer, now it reads the layer
+exported as GeoPackage. Both files are generated locally with the same
+point features, then every variant is read in its own process the way
+the upload reads it: all features are iterated and their geometries and
+attributes are serialized. Wall time and peak resident set size are
+reported. Network transfer is not included.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from _bench import megabytes, peak_rss, start_qgis
+
+
+VARIANTS = ("geojson", "gpkg")
+
+
+def generate(gpkg_path, geojson_path, features_count):
+    from osgeo import gdal, ogr, osr
+
+    gdal.UseExceptions()
+    srs = osr.SpatialReference()
+    srs.ImportFromEPSG(4326)
+
+    data_source = ogr.GetDriverByName("GPKG").CreateDataSource(gpkg_path)
+    layer = data_source.CreateLayer("layer", srs, ogr.wkbPoint)
+    layer.CreateField(ogr.FieldDefn("name", ogr.OFTString))
+    layer.CreateField(ogr.FieldDefn("value", ogr.OFTReal))
+    definition = layer.GetLayerDefn()
+
+    layer.StartTransaction()
+    for i in range(features_count):
+        feature = ogr.Feature(definition)
+        feature.SetField("name", "Feature {}".format(i))
+        feature.SetField("value", i * 0.5)
+        geometry = ogr.Geometry(ogr.wkbPoint)
+        geometry.AddPoint_2D(-180 + (i % 3600) * 0.1, -90 + (i // 3600 % 1800) * 0.1)
+        feature.SetGeometry(geometry)
+        layer.CreateFeature(feature)
+    layer.CommitTransaction()
+    data_source = None
+
+    gdal.VectorTranslate(geojson_path, gpkg_path, format="GeoJSON")
+
+
+def measure(variant, path):
+    start_qgis()
+    from qgis.core import QgsVectorLayer
+
+    rss_start = peak_rss()
+    start = time.perf_counter()
+
+    layer = QgsVectorLayer(path, "layer", "ogr")
+    assert layer.isValid(), path
+    features_count = 0
+    for feature in layer.getFeatures():
+        feature.geometry().asWkt()
+        feature.attributes()
+        features_count += 1
+
+    elapsed = time.perf_counter() - start
+    print("{:8} {:>9} features {:8.1f} s  peak {:>10} (QGIS started at {})".format(
+        variant, features_count, elapsed, megabytes(peak_rss()), megabytes(rss_start)
+    ))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--features", type=int, default=1000000)
+    parser.add_argument("--data-dir", default=tempfile.gettempdir())
+    parser.add_argument("--variant", choices=VARIANTS)
+    args = parser.parse_args()
+
+    paths = {
+        variant: os.path.join(
+            args.data_dir, "ngw_bench_{}.{}".format(args.features, variant)
+        )
+        for variant in VARIANTS
+    }
+
+    if args.variant is not None:
+        measure(args.variant, paths[args.variant])
+        return
+
+    if not all(os.path.exists(path) for path in paths.values()):
+        print("Generating {} features in {}".format(args.features, args.data_dir))
+        for path in paths.values():
+            if os.path.exists(path):
+                os.remove(path)
+        generate(paths["gpkg"], paths["geojson"], args.features)
+
+    for variant in VARIANTS:
+        print("{:8} file {:>10}".format(variant, megabytes(os.path.getsize(paths[variant]))))
+    for variant in VARIANTS:
+        subprocess.run([
+            sys.executable, __file__,
+            "--features", str(args.features),
+            "--data-dir", args.data_dir,
+            "--variant", variant,
+        ], check=True)
+
+
+if __name__ == "__main__":
+    main()
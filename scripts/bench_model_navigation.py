@@ -0,0 +1,83 @@
+"""Micro-benchmark of the model methods Qt views call while painting.
+
+The tree is a root group with many subgroups, every subgroup holds one
+layer, so parent() of a layer needs the row of its subgroup in the large
+group. parent() is compared with a linear search of that row, which is
+how rows were found before items cached their positions.
+"""
+import argparse
+
+from _bench import best_time, build_model, fake_resource, plugin_module
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--children", type=int, default=20000)
+    args = parser.parse_args()
+
+    model, next_id = build_model(args.children, 1)
+    model_module = plugin_module("tree_widget.model")
+    QModelIndex = model_module.QModelIndex
+    Qt = model_module.Qt
+
+    root_index = model.index(0, 0, QModelIndex())
+    rows = range(model.rowCount(root_index))
+    group_indexes = [model.index(row, 0, root_index) for row in rows]
+    layer_indexes = [model.index(0, 0, index) for index in group_indexes]
+    print("Group of {} children".format(len(group_indexes)))
+
+    def index_calls():
+        for row in rows:
+            model.index(row, 0, root_index)
+
+    def parent_calls():
+        for index in layer_indexes:
+            model.parent(index)
+
+    def linear_parent_calls():
+        for index in layer_indexes:
+            parent_item = index.internalPointer().parent()
+            row = parent_item.parent().children().index(parent_item)
+            model.createIndex(row, 0, parent_item)
+
+    def row_count_calls():
+        for index in group_indexes:
+            model.rowCount(index)
+
+    def has_children_calls():
+        for index in group_indexes:
+            model.hasChildren(index)
+
+    def data_calls():
+        for index in group_indexes:
+            model.data(index, Qt.DisplayRole)
+
+    def flags_calls():
+        for index in layer_indexes:
+            model.flags(index)
+
+    calls_count = len(group_indexes)
+    benchmarks = [
+        ("index()", index_calls),
+        ("parent()", parent_calls),
+        ("parent(), linear row", linear_parent_calls),
+        ("rowCount()", row_count_calls),
+        ("hasChildren()", has_children_calls),
+        ("data(DisplayRole)", data_calls),
+        ("flags()", flags_calls),
+    ]
+    for name, function in benchmarks:
+        elapsed = best_time(function) / calls_count
+        print("{:24} {:10.3f} us".format(name, elapsed * 1e6))
+
+    # Rows of the children are recalculated once after an insertion
+    def insert_and_parent_calls():
+        model.addNGWResourceToTree(root_index, fake_resource(next_id, "Group", True, 0))
+        parent_calls()
+
+    elapsed = best_time(insert_and_parent_calls, repeat=1)
+    print("{:24} {:10.3f} ms".format("insert + all parent()", elapsed * 1e3))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""Benchmark of looking up tree indexes by NGW resource id.
+
+The model keeps a map of items by resource id. The lookup is compared
+with the recursive walk over model indexes that was used before the map.
+"""
+import argparse
+import random
+
+from _bench import best_time, build_model, plugin_module
+
+
+def walk_lookup(model, ngw_resource_id, parent):
+    """Find the index the way the model did before the id map."""
+    item = parent.internalPointer()
+    if item.ngw_resource_id() == ngw_resource_id:
+        return parent
+
+    for i in range(item.childCount()):
+        index = walk_lookup(model, ngw_resource_id, model.index(i, 0, parent))
+        if index is not None:
+            return index
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--resources-per-group", type=int, default=1000)
+    parser.add_argument("--lookups", type=int, default=10000)
+    parser.add_argument("--walk-lookups", type=int, default=20)
+    args = parser.parse_args()
+
+    model, resources_count = build_model(args.groups, args.resources_per_group)
+    QModelIndex = plugin_module("tree_widget.model").QModelIndex
+    root_index = model.index(0, 0, QModelIndex())
+    print("Tree of {} resources".format(resources_count))
+
+    random.seed(0)
+    ids = [random.randrange(resources_count) for _ in range(args.lookups)]
+    walk_ids = ids[:args.walk_lookups]
+
+    for ngw_resource_id in walk_ids:
+        index = model.getIndexByNGWResourceId(ngw_resource_id)
+        assert walk_lookup(model, ngw_resource_id, root_index) == index
+
+    def map_lookups():
+        for ngw_resource_id in ids:
+            model.getIndexByNGWResourceId(ngw_resource_id)
+
+    def walk_lookups():
+        for ngw_resource_id in walk_ids:
+            walk_lookup(model, ngw_resource_id, root_index)
+
+    map_time = best_time(map_lookups) / len(ids)
+    walk_time = best_time(walk_lookups, repeat=1) / len(walk_ids)
+    print("Id map lookup:    {:12.2f} us".format(map_time * 1e6))
+    print("Recursive walk:   {:12.2f} us".format(walk_time * 1e6))
+    print("Speedup:          {:12.0f}x".format(walk_time / map_time))
+
+
+if __name__ == "__main__":
+    main()
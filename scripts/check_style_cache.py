@@ -0,0 +1,106 @@
+"""Check that QML styles are got through NGWStyleCache.
+
+A local HTTP server serves a style. The style is fetched into an empty
+cache, then fetched again, and the second fetch must be served from the
+cache without a request.
+"""
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from types import SimpleNamespace
+
+from _bench import plugin_module, start_qgis
+
+
+QML = b"<!DOCTYPE qgis><qgis version=\"3.10\"><renderer-v2/></qgis>\n" * 1000
+TIMEOUT = 10000
+
+
+class StyleHandler(BaseHTTPRequestHandler):
+    requests_count = 0
+
+    def do_GET(self):
+        StyleHandler.requests_count += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "application/xml")
+        self.send_header("Content-Length", str(len(QML)))
+        self.send_header("ETag", "\"{}\"".format(hashlib.sha1(QML).hexdigest()))
+        self.end_headers()
+        self.wfile.write(QML)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def fetch(style_cache, session, ngw_style):
+    from qgis.PyQt.QtCore import QEventLoop, QTimer
+
+    request = style_cache.fetch(session, ngw_style)
+    loop = QEventLoop()
+    request.done.connect(loop.quit)
+    request.failed.connect(loop.quit)
+    # Broken requests never finish, so the wait is limited
+    timer = QTimer()
+    timer.setSingleShot(True)
+    timer.timeout.connect(loop.quit)
+    timer.start(TIMEOUT)
+    loop.exec_()
+    timer.stop()
+    return request
+
+
+def main():
+    start_qgis()
+    NGWSession = plugin_module("ngw_session").NGWSession
+    NGWStyleCache = plugin_module("ngw_style_cache").NGWStyleCache
+
+    server = HTTPServer(("127.0.0.1", 0), StyleHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = "http://127.0.0.1:{}".format(server.server_port)
+
+    session = NGWSession(SimpleNamespace(
+        server_url=url, username=None, password=None, proxy_enable=False
+    ))
+    ngw_style = SimpleNamespace(
+        common=SimpleNamespace(id=1),
+        download_qml_url=lambda: url + "/api/resource/1/qml",
+        get_creds_for_qml=lambda: None,
+    )
+
+    failures = []
+    with tempfile.TemporaryDirectory() as cache_dir:
+        style_cache = NGWStyleCache(cache_dir=cache_dir)
+
+        request = fetch(style_cache, session, ngw_style)
+        file_path = request.filePath()
+        if file_path is None:
+            failures.append("fetch on an empty cache is not resolved: {}".format(request.error()))
+        else:
+            with open(file_path, "rb") as style_file:
+                if style_file.read() != QML:
+                    failures.append("cached style differs from the served one")
+            parts = [name for name in os.listdir(cache_dir) if name.endswith(NGWStyleCache.PART_SUFFIX)]
+            if len(parts) > 0:
+                failures.append("partial files are left: {}".format(parts))
+
+            request = fetch(style_cache, session, ngw_style)
+            if request.filePath() != file_path:
+                failures.append("second fetch is not resolved from the cache")
+            if StyleHandler.requests_count != 1:
+                failures.append("server got {} requests instead of 1".format(StyleHandler.requests_count))
+
+    server.shutdown()
+    session.close()
+
+    for failure in failures:
+        print("FAIL:", failure)
+    if len(failures) > 0:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
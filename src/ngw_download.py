@@ -0,0 +1,311 @@
+"""
+/***************************************************************************
+ Download engine for large NextGIS Web files
+                                 A QGIS plugin
+ NextGIS Connect
+                             -------------------
+        copyright            : (C) 2014 by NextGIS
+        email                : info@nextgis.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import time
+
+from qgis.PyQt.QtCore import QEventLoop, QFile, QIODevice, QObject, pyqtSignal
+from qgis.PyQt.QtNetwork import QNetworkReply, QNetworkRequest
+
+from .ngw_api.utils import log
+
+
+__all__ = ["NGWDownloader"]
+
+
+class NGWDownloader(QObject):
+    """Downloads a file with parallel HTTP Range requests.
+
+    The first request asks for the first chunk and tells whether the
+    server supports ranges and how large the file is. The target file is
+    preallocated and every chunk is written at its own offset as data
+    arrives. Interrupted chunks are requested again from the last written
+    byte.
+
+    Every chunk is requested with If-Range, and the ETag of its reply is
+    compared with the first one. If the file is changed on the server, the
+    download starts over instead of mixing versions. Files without range
+    support or without a strong ETag are downloaded with a single request.
+    Files generated on request, like exports, are built again for every
+    range, so they are downloaded with ranged=False. The downloader works
+    in any thread that runs an event loop.
+    """
+
+    CHUNK_SIZE = 8 * 1024 * 1024
+    PARALLEL_REQUESTS = 4
+    MAX_RETRIES = 3
+
+    progressChanged = pyqtSignal(object, object)
+    finished = pyqtSignal()
+    failed = pyqtSignal(str)
+
+    def __init__(self, session, url, file_path, creds=None, ranged=True, parent=None):
+        super().__init__(parent)
+        self.__session = session
+        self.__url = url
+        self.__file_path = file_path
+        self.__creds = creds
+        self.__ranged = ranged
+
+        self.__file = None
+        self.__total_size = None
+        self.__validator = None
+        self.__pending_chunks = []
+        # reply -> [chunk start, chunk end, written bytes, retries, probe]
+        self.__active_replies = {}
+        self.__restarts = 0
+        self.__downloaded_size = 0
+        self.__received_size = 0
+        self.__started_at = None
+        self.__error = None
+        self.__done = False
+
+    def error(self):
+        return self.__error
+
+    def filePath(self):
+        return self.__file_path
+
+    def throughput(self):
+        """Return the average download rate in bytes per second."""
+        if self.__started_at is None:
+            return 0.0
+        elapsed = time.monotonic() - self.__started_at
+        return self.__received_size / elapsed if elapsed > 0 else 0.0
+
+    def start(self):
+        self.__started_at = time.monotonic()
+        self.__file = QFile(self.__file_path)
+        if not self.__file.open(QIODevice.WriteOnly):
+            self.__fail("Can't open {} for writing: {}".format(
+                self.__file_path, self.__file.errorString()
+            ))
+            return
+
+        if not self.__ranged:
+            self.__startChunk(0, None, 0, 0)
+            return
+        # The first chunk also tells the size and the range support
+        self.__startChunk(0, self.CHUNK_SIZE - 1, 0, 0, probe=True)
+
+    def wait(self):
+        """Process events until the download ends, return True on success."""
+        if not self.__done:
+            loop = QEventLoop()
+            self.finished.connect(loop.quit)
+            self.failed.connect(loop.quit)
+            loop.exec_()
+        return self.__error is None
+
+    def abort(self):
+        if self.__done:
+            return
+        self.__fail("Download aborted")
+
+    def __startChunk(self, start, end, written, retries, probe=False):
+        headers = {}
+        if end is not None:
+            headers["Range"] = "bytes={}-{}".format(start + written, end)
+            if self.__validator is not None:
+                # Server sends the whole new file if this one is changed
+                headers["If-Range"] = self.__validator
+
+        reply = self.__session.get(self.__url, self.__creds, headers)
+
+        # [start, end, written bytes, retries, waits for the first response]
+        self.__active_replies[reply] = [start, end, written, retries, probe]
+        reply.readyRead.connect(self.__onReadyRead)
+        reply.finished.connect(self.__onReplyFinished)
+
+    def __stopReply(self, reply):
+        del self.__active_replies[reply]
+        reply.finished.disconnect()
+        reply.readyRead.disconnect()
+        reply.abort()
+        reply.deleteLater()
+
+    def __onReadyRead(self):
+        reply = self.sender()
+        chunk = self.__active_replies.get(reply)
+        if chunk is not None:
+            self.__readReply(reply, chunk)
+
+    def __readReply(self, reply, chunk):
+        """Write received data, return False if the reply was dropped."""
+        if chunk[4] and not self.__processFirstResponse(reply, chunk):
+            return False
+        if chunk[1] is not None and not self.__isSameVersion(reply):
+            self.__restart("{} is changed on the server".format(self.__url))
+            return False
+
+        data = reply.readAll()
+        if data.size() == 0 or not self.__isDataReply(reply, chunk):
+            return True  # error pages are not written to the file
+        if self.__total_size is None:
+            self.__total_size = reply.header(QNetworkRequest.ContentLengthHeader)
+
+        self.__file.seek(chunk[0] + chunk[2])
+        self.__file.write(data)
+        chunk[2] += data.size()
+        self.__received_size += data.size()
+        self.__downloaded_size += data.size()
+        self.progressChanged.emit(self.__downloaded_size, self.__total_size)
+        return True
+
+    def __isDataReply(self, reply, chunk):
+        status = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        return status == (200 if chunk[1] is None else 206)
+
+    def __isSameVersion(self, reply):
+        """Check that a ranged reply comes from the first seen file."""
+        status = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        if status == 200:
+            return False  # If-Range didn't match
+        if status != 206:
+            return True  # error is reported when the reply is finished
+        return self.__replyValidator(reply) == self.__validator
+
+    def __replyValidator(self, reply):
+        """Return the strong ETag of a reply, or None."""
+        etag = bytes(reply.rawHeader(b"ETag")).decode()
+        if etag and not etag.startswith("W/"):
+            return etag
+        return None
+
+    def __processFirstResponse(self, reply, chunk):
+        """Plan chunks from the first response, return False if it is dropped."""
+        status = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        if status is None or status >= 400:
+            return True  # error is reported when the reply is finished
+        chunk[4] = False
+
+        content_range = bytes(reply.rawHeader(b"Content-Range")).decode()
+        if status != 206 or "/" not in content_range or content_range.endswith("/*"):
+            # Ranges are not supported, the whole file comes in this reply
+            self.__total_size = reply.header(QNetworkRequest.ContentLengthHeader)
+            chunk[1] = None
+            self.__file.resize(0)
+            return True
+
+        self.__total_size = int(content_range.rsplit("/", 1)[1])
+        self.__validator = self.__replyValidator(reply)
+        if self.__validator is None:
+            # Chunks can't be checked to come from one version of the file
+            self.__stopReply(reply)
+            self.__startChunk(0, None, 0, 0)
+            return False
+
+        self.__file.resize(self.__total_size)
+
+        # The first response carries the first chunk
+        chunk[1] = min(self.CHUNK_SIZE, self.__total_size) - 1
+        self.__pending_chunks = []
+        for start in range(self.CHUNK_SIZE, self.__total_size, self.CHUNK_SIZE):
+            end = min(start + self.CHUNK_SIZE, self.__total_size) - 1
+            self.__pending_chunks.append((start, end, 0))
+        self.__pending_chunks.reverse()
+        self.__startPendingChunks()
+        return True
+
+    def __startPendingChunks(self):
+        while len(self.__pending_chunks) > 0 and len(self.__active_replies) < self.PARALLEL_REQUESTS:
+            start, end, written = self.__pending_chunks.pop()
+            self.__startChunk(start, end, written, 0)
+
+    def __onReplyFinished(self):
+        reply = self.sender()
+        chunk = self.__active_replies.get(reply)
+        if chunk is None:
+            reply.deleteLater()
+            return
+        if reply.error() == QNetworkReply.NoError and not self.__readReply(reply, chunk):
+            return
+
+        del self.__active_replies[reply]
+        reply.deleteLater()
+
+        start, end, written, retries, _ = chunk
+        if reply.error() != QNetworkReply.NoError:
+            error = reply.errorString()
+        elif end is not None and written < end - start + 1:
+            # Server ignored the range or closed the connection early
+            error = "incomplete response with status {}".format(
+                reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+            )
+        else:
+            error = None
+
+        if error is not None:
+            if retries >= self.MAX_RETRIES or self.__isPermanentError(reply):
+                self.__fail("Download of {} failed: {}".format(self.__url, error))
+                return
+            log("Chunk {} of {} is interrupted, resuming: {}".format(
+                start, self.__url, error
+            ))
+            if end is None:
+                # Without ranges the file is downloaded from the beginning
+                self.__downloaded_size -= written
+                written = 0
+                self.__file.resize(0)
+            self.__startChunk(start, end, written, retries + 1, probe=chunk[4])
+            return
+
+        self.__startPendingChunks()
+
+        if len(self.__active_replies) == 0 and len(self.__pending_chunks) == 0:
+            self.__finish()
+
+    def __isPermanentError(self, reply):
+        status = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        return status is not None and 400 <= status < 500
+
+    def __restart(self, reason):
+        """Drop everything written and download the file again."""
+        for reply in list(self.__active_replies):
+            self.__stopReply(reply)
+        self.__pending_chunks = []
+        if self.__restarts >= self.MAX_RETRIES:
+            self.__fail("Download of {} failed: {}".format(self.__url, reason))
+            return
+
+        self.__restarts += 1
+        log("Download of {} starts over: {}".format(self.__url, reason))
+        self.__total_size = None
+        self.__validator = None
+        self.__downloaded_size = 0
+        self.__file.resize(0)
+        self.__startChunk(0, self.CHUNK_SIZE - 1, 0, 0, probe=True)
+
+    def __finish(self):
+        self.__file.close()
+        self.__done = True
+        log("Downloaded {} bytes of {} at {:.0f} B/s".format(
+            self.__downloaded_size, self.__url, self.throughput()
+        ))
+        self.finished.emit()
+
+    def __fail(self, message):
+        for reply in list(self.__active_replies):
+            self.__stopReply(reply)
+        self.__pending_chunks = []
+        if self.__file is not None and self.__file.isOpen():
+            self.__file.close()
+        self.__error = message
+        self.__done = True
+        log(message)
+        self.failed.emit(message)
@@ -0,0 +1,224 @@
+"""
+/***************************************************************************
+ Shared network session of a NextGIS Web connection
+                                 A QGIS plugin
+ NextGIS Connect
+                             -------------------
+        copyright            : (C) 2014 by NextGIS
+        email                : info@nextgis.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import threading
+from functools import partial
+
+from qgis.PyQt.QtCore import QByteArray, QObject, QThread, QUrl
+from qgis.PyQt.QtNetwork import QNetworkAccessManager, QNetworkRequest, QSsl, QSslConfiguration
+
+from .ngw_api.qgis.qgis_ngw_connection import QgsNgwConnection
+from .ngw_api.utils import log
+
+
+__all__ = ["NGWSession"]
+
+
+class NGWSession(QObject):
+    """Network state shared by everything that talks to one NGW connection.
+
+    The session keeps a single QgsNgwConnection for model jobs and a
+    QNetworkAccessManager for downloads in every thread that downloads.
+    A manager keeps HTTP connections alive and pools them, no more than
+    six per host, and TLS sessions are resumed on new connections.
+    """
+
+    __sessions = {}
+
+    def __init__(self, ngw_connection_settings):
+        super().__init__()
+        self.__connection_settings = ngw_connection_settings
+        self.__connection = None
+        self.__network_manager = None
+        # Managers belong to their threads, job threads get their own ones
+        self.__thread_network_managers = {}
+        self.__lock = threading.Lock()
+
+        self.__ssl_configuration = QSslConfiguration.defaultConfiguration()
+        self.__ssl_configuration.setSslOption(QSsl.SslOptionDisableSessionPersistence, False)
+        self.__ssl_configuration.setSslOption(QSsl.SslOptionDisableSessionTickets, False)
+
+        self.__requests_count = 0
+        self.__finished_count = 0
+        self.__https_finished_count = 0
+        self.__new_connections_count = 0
+        self.__connections_created = 0
+
+    @classmethod
+    def forConnection(cls, ngw_connection_settings):
+        """Return the session of the connection, create it if needed."""
+        key = cls.connectionKey(ngw_connection_settings)
+        session = cls.__sessions.get(key)
+        if session is None or not cls.isSameConnection(session.__connection_settings, ngw_connection_settings):
+            if session is not None:
+                session.close()
+            session = cls(ngw_connection_settings)
+            cls.__sessions[key] = session
+        return session
+
+    @classmethod
+    def closeAll(cls):
+        for session in cls.__sessions.values():
+            session.close()
+        cls.__sessions = {}
+
+    @classmethod
+    def connectionKey(cls, ngw_connection_settings, with_protocol=True):
+        """Return what identifies the server side of a connection.
+
+        Connections with equal keys reach the same server as the same user
+        through the same proxy, secrets are not part of the key.
+        """
+        url = ngw_connection_settings.server_url.strip().rstrip("/")
+        if not with_protocol:
+            url = url.split("://", 1)[-1]
+
+        username = ngw_connection_settings.username or None
+        auth_method = "basic" if username is not None else "anonymous"
+
+        proxy = None
+        if getattr(ngw_connection_settings, "proxy_enable", False):
+            proxy = (
+                ngw_connection_settings.proxy_host,
+                str(ngw_connection_settings.proxy_port),
+                ngw_connection_settings.proxy_user or None,
+            )
+
+        return (url, auth_method, username, proxy)
+
+    @classmethod
+    def isSameConnection(cls, ngw_connection_settings, other, with_protocol=True):
+        """Check that both settings connect the same way with the same secrets."""
+        if ngw_connection_settings is None or other is None:
+            return ngw_connection_settings is other
+
+        if cls.connectionKey(ngw_connection_settings, with_protocol) != cls.connectionKey(other, with_protocol):
+            return False
+        return (
+            ngw_connection_settings.password == other.password and
+            getattr(ngw_connection_settings, "proxy_password", None) == getattr(other, "proxy_password", None)
+        )
+
+    def connectionSettings(self):
+        return self.__connection_settings
+
+    def connection(self):
+        """Return the connection used by model jobs."""
+        if self.__connection is None:
+            self.__connection = QgsNgwConnection(self.__connection_settings)
+            self.__connections_created += 1
+        return self.__connection
+
+    def networkManager(self):
+        """Return the network manager of the current thread.
+
+        A manager of a job thread is kept until the thread is finished, so
+        jobs run by the same thread share its connections.
+        """
+        thread = QThread.currentThread()
+        if thread == self.thread():
+            if self.__network_manager is None:
+                self.__network_manager = QNetworkAccessManager(self)
+            return self.__network_manager
+
+        with self.__lock:
+            network_manager = self.__thread_network_managers.get(thread)
+            if network_manager is None:
+                network_manager = QNetworkAccessManager()
+                thread.finished.connect(network_manager.deleteLater)
+                thread.finished.connect(partial(self.__forgetThread, thread))
+                self.__thread_network_managers[thread] = network_manager
+        return network_manager
+
+    def request(self, url, creds=None):
+        """Build a request with the session TLS options and credentials."""
+        request = QNetworkRequest(QUrl(url))
+        request.setSslConfiguration(self.__ssl_configuration)
+
+        if creds is None and self.__connection_settings.username:
+            creds = (self.__connection_settings.username, self.__connection_settings.password)
+        if creds is not None:
+            creds_str = "{}:{}".format(creds[0], creds[1])
+            authstr = QByteArray(creds_str.encode("utf-8")).toBase64()
+            request.setRawHeader(b"Authorization", QByteArray(b"Basic ").append(authstr))
+
+        return request
+
+    def get(self, url, creds=None, headers=None):
+        request = self.request(url, creds)
+        for name, value in (headers or {}).items():
+            request.setRawHeader(name.encode("utf-8"), value.encode("utf-8"))
+        reply = self.networkManager().get(request)
+        self.__trackReply(reply)
+        return reply
+
+    def stats(self):
+        """Return counters of requests and reused versus new connections.
+
+        A new encrypted connection is detected by its TLS handshake, so
+        connections are only counted for HTTPS requests. Reuse is None
+        when no HTTPS request is finished.
+        """
+        reused_connections = None
+        if self.__https_finished_count > 0:
+            reused_connections = max(self.__https_finished_count - self.__new_connections_count, 0)
+        return {
+            "requests": self.__requests_count,
+            "finished": self.__finished_count,
+            "https_finished": self.__https_finished_count,
+            "new_connections": self.__new_connections_count,
+            "reused_connections": reused_connections,
+            "ngw_connections_created": self.__connections_created,
+        }
+
+    def close(self):
+        log("Network session of {} closed: {}".format(
+            self.__connection_settings.server_url, self.stats()
+        ))
+        if self.__network_manager is not None:
+            self.__network_manager.deleteLater()
+            self.__network_manager = None
+        with self.__lock:
+            for network_manager in self.__thread_network_managers.values():
+                network_manager.deleteLater()
+            self.__thread_network_managers = {}
+        self.__connection = None
+
+    def __forgetThread(self, thread):
+        with self.__lock:
+            self.__thread_network_managers.pop(thread, None)
+
+    def __trackReply(self, reply):
+        with self.__lock:
+            self.__requests_count += 1
+        reply.encrypted.connect(self.__onEncrypted)
+        if reply.url().scheme() == "https":
+            reply.finished.connect(self.__onHttpsFinished)
+        else:
+            reply.finished.connect(self.__onFinished)
+
+    def __onEncrypted(self):
+        self.__new_connections_count += 1
+
+    def __onFinished(self):
+        self.__finished_count += 1
+
+    def __onHttpsFinished(self):
+        self.__finished_count += 1
+        self.__https_finished_count += 1
@@ -0,0 +1,332 @@
+"""
+/***************************************************************************
+ On-disk cache of QML styles downloaded from NextGIS Web
+                                 A QGIS plugin
+ NextGIS Connect
+                             -------------------
+        copyright            : (C) 2014 by NextGIS
+        email                : info@nextgis.com
+ ***************************************************************************/
+
+/***************************************************************************
+ *                                                                         *
+ *   This program is free software; you can redistribute it and/or modify  *
+ *   it under the terms of the GNU General Public License as published by  *
+ *   the Free Software Foundation; either version 2 of the License, or     *
+ *   (at your option) any later version.                                   *
+ *                                                                         *
+ ***************************************************************************/
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+from qgis.core import QgsApplication
+from qgis.PyQt.QtCore import QEventLoop, QObject, QTimer, pyqtSignal
+from qgis.PyQt.QtNetwork import QNetworkReply, QNetworkRequest
+
+from .ngw_api.utils import log
+from .ngw_session import NGWSession
+from .plugin_settings import PluginSettings
+
+
+__all__ = ["NGWStyleCache", "NGWStyleRequest"]
+
+
+class NGWStyleCache(QObject):
+    """Keeps QML styles on disk between sessions.
+
+    Styles are stored by the hash of their content, so equal styles share
+    a file. The index maps a style of a connection to its file and to the
+    ETag or Last-Modified of the server response. A style checked less than
+    style_cache_max_age seconds ago is used without any request, an older
+    one is revalidated with a conditional request. When the cache grows
+    over style_cache_size megabytes, least recently used styles are removed.
+    """
+
+    INDEX_FILE = "index.json"
+    STYLE_SUFFIX = ".qml"
+    PART_SUFFIX = ".part"
+
+    def __init__(self, parent=None, cache_dir=None):
+        super().__init__(parent)
+        if cache_dir is None:
+            cache_dir = os.path.join(
+                QgsApplication.qgisSettingsDirPath(), "cache", "nextgis_connect", "qml"
+            )
+        self.__cache_dir = cache_dir
+        self.__entries = None
+        # Styles may be requested from job threads too
+        self.__lock = threading.Lock()
+
+    def fetch(self, session, ngw_style):
+        """Start getting the QML of a style, return NGWStyleRequest."""
+        key = self.__entryKey(session, ngw_style)
+        request = NGWStyleRequest(
+            self, session, key, ngw_style.download_qml_url(), ngw_style.get_creds_for_qml()
+        )
+        request.start()
+        return request
+
+    def clear(self):
+        with self.__lock:
+            self.__loadIndex()
+            for entry in self.__entries.values():
+                self.__removeFile(self.stylePath(entry["digest"]))
+            self.__entries = {}
+            self.__saveIndex()
+
+    def stylePath(self, digest):
+        return os.path.join(self.__cache_dir, digest + self.STYLE_SUFFIX)
+
+    def _partPath(self):
+        os.makedirs(self.__cache_dir, exist_ok=True)
+        return os.path.join(self.__cache_dir, uuid.uuid4().hex + self.PART_SUFFIX)
+
+    def _lookup(self, key):
+        """Return a copy of the entry if its file is still on disk."""
+        with self.__lock:
+            self.__loadIndex()
+            entry = self.__entries.get(key)
+            if entry is None or not os.path.exists(self.stylePath(entry["digest"])):
+                return None
+            return dict(entry)
+
+    def _touch(self, key, revalidated=False):
+        with self.__lock:
+            self.__loadIndex()
+            entry = self.__entries.get(key)
+            if entry is None:
+                return
+            entry["used_at"] = time.time()
+            if revalidated:
+                entry["checked_at"] = entry["used_at"]
+            self.__saveIndex()
+
+    def _store(self, key, part_path, digest, etag, last_modified):
+        """Move the downloaded file into the cache, return its path."""
+        style_path = self.stylePath(digest)
+        with self.__lock:
+            self.__loadIndex()
+            if os.path.exists(style_path):
+                self.__removeFile(part_path)
+            else:
+                os.replace(part_path, style_path)
+
+            now = time.time()
+            old_entry = self.__entries.get(key)
+            self.__entries[key] = {
+                "digest": digest,
+                "etag": etag,
+                "last_modified": last_modified,
+                "size": os.path.getsize(style_path),
+                "checked_at": now,
+                "used_at": now,
+            }
+            if old_entry is not None and old_entry["digest"] != digest:
+                self.__removeUnreferenced(old_entry["digest"])
+            self.__evict(keep=key)
+            self.__saveIndex()
+        return style_path
+
+    def __entryKey(self, session, ngw_style):
+        connection_key = NGWSession.connectionKey(session.connectionSettings())
+        connection_hash = hashlib.sha1(repr(connection_key).encode("utf-8")).hexdigest()
+        return "{}/{}".format(connection_hash, ngw_style.common.id)
+
+    def __evict(self, keep):
+        limit = PluginSettings.style_cache_size() * 1024 * 1024
+        sizes = {}
+        for entry in self.__entries.values():
+            sizes[entry["digest"]] = entry["size"]
+        total_size = sum(sizes.values())
+
+        for key, entry in sorted(self.__entries.items(), key=lambda item: item[1]["used_at"]):
+            if total_size <= limit:
+                break
+            if key == keep:
+                continue
+            del self.__entries[key]
+            if self.__removeUnreferenced(entry["digest"]):
+                total_size -= entry["size"]
+
+    def __removeUnreferenced(self, digest):
+        for entry in self.__entries.values():
+            if entry["digest"] == digest:
+                return False
+        self.__removeFile(self.stylePath(digest))
+        return True
+
+    def __removeFile(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def __loadIndex(self):
+        if self.__entries is not None:
+            return
+        try:
+            with open(os.path.join(self.__cache_dir, self.INDEX_FILE), "r") as index_file:
+                self.__entries = json.load(index_file)
+        except (OSError, ValueError):
+            self.__entries = {}
+
+    def __saveIndex(self):
+        try:
+            os.makedirs(self.__cache_dir, exist_ok=True)
+            with open(os.path.join(self.__cache_dir, self.INDEX_FILE), "w") as index_file:
+                json.dump(self.__entries, index_file)
+        except OSError as error:
+            log("Failed to save style cache index: {}".format(error))
+
+
+class NGWStyleRequest(QObject):
+    """Getting of one QML style through NGWStyleCache.
+
+    The style is streamed to a file inside the cache as it arrives.
+    If the server can't be reached, a cached copy is used even if it is
+    outdated.
+    """
+
+    done = pyqtSignal(str)
+    failed = pyqtSignal(str)
+
+    def __init__(self, cache, session, key, url, creds):
+        super().__init__()
+        self.__cache = cache
+        self.__session = session
+        self.__key = key
+        self.__url = url
+        self.__creds = creds
+
+        self.__entry = None
+        self.__reply = None
+        self.__part_file = None
+        self.__part_path = None
+        self.__hash = None
+        self.__file_path = None
+        self.__error = None
+        self.__done = False
+
+    def error(self):
+        return self.__error
+
+    def filePath(self):
+        """Return path of the cached QML, it must not be changed."""
+        return self.__file_path
+
+    def start(self):
+        self.__entry = self.__cache._lookup(self.__key)
+        if self.__entry is not None:
+            age = time.time() - self.__entry["checked_at"]
+            if 0 <= age < PluginSettings.style_cache_max_age():
+                QTimer.singleShot(0, self.__useCached)
+                return
+
+        headers = {}
+        if self.__entry is not None:
+            if self.__entry["etag"]:
+                headers["If-None-Match"] = self.__entry["etag"]
+            if self.__entry["last_modified"]:
+                headers["If-Modified-Since"] = self.__entry["last_modified"]
+
+        self.__reply = self.__session.get(self.__url, self.__creds, headers)
+        self.__reply.readyRead.connect(self.__onReadyRead)
+        self.__reply.finished.connect(self.__onFinished)
+
+    def wait(self):
+        """Process events until the style is got, return True on success."""
+        if not self.__done:
+            loop = QEventLoop()
+            self.done.connect(loop.quit)
+            self.failed.connect(loop.quit)
+            loop.exec_()
+        return self.__error is None
+
+    def __onReadyRead(self):
+        self.__readReply(self.__reply)
+
+    def __readReply(self, reply):
+        status = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        if status != 200 or self.__error is not None:
+            return
+
+        if self.__part_file is None:
+            try:
+                self.__part_path = self.__cache._partPath()
+                self.__part_file = open(self.__part_path, "wb")
+            except OSError as error:
+                self.__error = "Can't write style to the cache: {}".format(error)
+                reply.abort()
+                return
+            self.__hash = hashlib.sha256()
+
+        data = bytes(reply.readAll())
+        self.__part_file.write(data)
+        self.__hash.update(data)
+
+    def __onFinished(self):
+        reply = self.__reply
+        self.__reply = None
+        reply.deleteLater()
+
+        status = reply.attribute(QNetworkRequest.HttpStatusCodeAttribute)
+        if reply.error() == QNetworkReply.NoError:
+            self.__readReply(reply)
+
+        if self.__part_file is not None:
+            self.__part_file.close()
+
+        if self.__error is not None or reply.error() != QNetworkReply.NoError:
+            self.__removePart()
+            error = self.__error or reply.errorString()
+            if self.__entry is not None and (status is None or status >= 500):
+                log("Failed to revalidate QML {}, the cached one is used: {}".format(self.__url, error))
+                self.__useCached()
+            else:
+                self.__fail("Failed to download QML: {}".format(error))
+            return
+
+        if status == 304 and self.__entry is not None:
+            self.__cache._touch(self.__key, revalidated=True)
+            self.__finish(self.__cache.stylePath(self.__entry["digest"]))
+            return
+
+        if self.__part_file is None:
+            self.__fail("Failed to download QML: unexpected response status {}".format(status))
+            return
+
+        file_path = self.__cache._store(
+            self.__key,
+            self.__part_path,
+            self.__hash.hexdigest(),
+            bytes(reply.rawHeader(b"ETag")).decode(),
+            bytes(reply.rawHeader(b"Last-Modified")).decode(),
+        )
+        self.__finish(file_path)
+
+    def __useCached(self):
+        self.__cache._touch(self.__key)
+        self.__finish(self.__cache.stylePath(self.__entry["digest"]))
+
+    def __finish(self, file_path):
+        self.__file_path = file_path
+        self.__done = True
+        self.done.emit(file_path)
+
+    def __fail(self, message):
+        self.__error = message
+        self.__done = True
+        log(message)
+        self.failed.emit(message)
+
+    def __removePart(self):
+        if self.__part_path is not None:
+            try:
+                os.remove(self.__part_path)
+            except OSError:
+                pass
@@ -118,3 +118,119 @@ class PluginSettings(CommonPluginSettings):
     def set_debug_mode(cls, val):
         settings = cls.get_settings()
         settings.setValue('/debugMode', val)
+
+    @classmethod
+    def fetch_page_size(cls):
+        settings = cls.get_settings()
+        return settings.value('/tree/fetchPageSize', 500, type=int)
+
+    @classmethod
+    def set_fetch_page_size(cls, val):
+        settings = cls.get_settings()
+        settings.setValue('/tree/fetchPageSize', val)
+
+    @classmethod
+    def max_concurrent_jobs(cls):
+        settings = cls.get_settings()
+        return settings.value('/jobs/maxConcurrentJobs', 4, type=int)
+
+    @classmethod
+    def set_max_concurrent_jobs(cls, val):
+        settings = cls.get_settings()
+        settings.setValue('/jobs/maxConcurrentJobs', val)
+
+    @classmethod
+    def prefetch_enabled(cls):
+        settings = cls.get_settings()
+        return settings.value('/tree/prefetchEnabled', False, type=bool)
+
+    @classmethod
+    def set_prefetch_enabled(cls, val):
+        settings = cls.get_settings()
+        settings.setValue('/tree/prefetchEnabled', val)
+
+    @classmethod
+    def prefetch_depth(cls):
+        settings = cls.get_settings()
+        return settings.value('/tree/prefetchDepth', 1, type=int)
+
+    @classmethod
+    def set_prefetch_depth(cls, val):
+        settings = cls.get_settings()
+        settings.setValue('/tree/prefetchDepth', val)
+
+    @classmethod
+    def prefetch_budget(cls):
+        settings = cls.get_settings()
+        return settings.value('/tree/prefetchBudget', 16, type=int)
+
+    @classmethod
+    def set_prefetch_budget(cls, val):
+        settings = cls.get_settings()
+        settings.setValue('/tree/prefetchBudget', val)
+
+    @classmethod
+    def ngw_version_cache(cls, connection_key):
+        """Return cached version of a connection and time of the check.
+
+        Version is None if it is unknown, time is 0 if it was never checked.
+        """
+        settings = cls.get_settings()
+        version = settings.value('/versionCache/{}/version'.format(connection_key), '', type=str)
+        checked_at = settings.value('/versionCache/{}/checkedAt'.format(connection_key), 0.0, type=float)
+        return version or None, checked_at
+
+    @classmethod
+    def set_ngw_version_cache(cls, connection_key, version, checked_at):
+        settings = cls.get_settings()
+        settings.setValue('/versionCache/{}/version'.format(connection_key), version or '')
+        settings.setValue('/versionCache/{}/checkedAt'.format(connection_key), checked_at)
+
+    @classmethod
+    def search_by_parent_cache(cls, connection_key):
+        """Return whether a connection can search resources by parents and time of the check.
+
+        Support is None if it is unknown.
+        """
+        settings = cls.get_settings()
+        supported = settings.value('/versionCache/{}/searchByParent'.format(connection_key), '', type=str)
+        checked_at = settings.value('/versionCache/{}/searchByParentCheckedAt'.format(connection_key), 0.0, type=float)
+        return {'true': True, 'false': False}.get(supported), checked_at
+
+    @classmethod
+    def set_search_by_parent_cache(cls, connection_key, supported, checked_at):
+        settings = cls.get_settings()
+        settings.setValue('/versionCache/{}/searchByParent'.format(connection_key), 'true' if supported else 'false')
+        settings.setValue('/versionCache/{}/searchByParentCheckedAt'.format(connection_key), checked_at)
+
+    @classmethod
+    def ngw_version_cache_ttl(cls):
+        settings = cls.get_settings()
+        return settings.value('/versionCache/ttl', 24 * 60 * 60, type=int)
+
+    @classmethod
+    def set_ngw_version_cache_ttl(cls, val):
+        settings = cls.get_settings()
+        settings.setValue('/versionCache/ttl', val)
+
+    @classmethod
+    def style_cache_size(cls):
+        """Return the limit of the QML style cache in megabytes."""
+        settings = cls.get_settings()
+        return settings.value('/styleCache/size', 50, type=int)
+
+    @classmethod
+    def set_style_cache_size(cls, val):
+        settings = cls.get_settings()
+        settings.setValue('/styleCache/size', val)
+
+    @classmethod
+    def style_cache_max_age(cls):
+        """Return seconds a cached style is used without revalidation."""
+        settings = cls.get_settings()
+        return settings.value('/styleCache/maxAge', 10 * 60, type=int)
+
+    @classmethod
+    def set_style_cache_max_age(cls, val):
+        settings = cls.get_settings()
+        settings.setValue('/styleCache/maxAge', val)
@@ -21,6 +21,7 @@
 """
 import html
 import os
+import shutil
 import traceback
 
 from qgis.core import (
@@ -29,11 +30,9 @@ from qgis.core import (
 )
 from qgis.PyQt import uic
 from qgis.PyQt.QtCore import (
-    QByteArray, QEventLoop, QFile, QIODevice, QModelIndex, QSettings, QSize, Qt,
-    QTemporaryFile, QUrl,
+    QModelIndex, QSettings, QSize, Qt, QUrl,
 )
 from qgis.PyQt.QtGui import QDesktopServices, QIcon
-from qgis.PyQt.QtNetwork import QNetworkAccessManager, QNetworkRequest
 from qgis.PyQt.QtWidgets import (
     QAction, QDockWidget, QFileDialog, QInputDialog, QLineEdit, QMainWindow, QMenu, QMessageBox,
     QPushButton, QSizePolicy, QToolBar, QToolButton,
@@ -67,12 +66,12 @@ from .ngw_api.qgis.resource_to_map import (
     add_resource_as_geojson, add_resource_as_geojson_with_style,
     add_resource_as_wfs_layers, UnsupportedRasterTypeException,
 )
-from .ngw_api.qgis.ngw_resource_model_4qgis import QGISResourceJob
-from .ngw_api.qgis.qgis_ngw_connection import QgsNgwConnection
 
-from .ngw_api.utils import log, setDebugEnabled, setLogger
+from .ngw_api.utils import setDebugEnabled, setLogger
 
 from . import utils
+from .ngw_session import NGWSession
+from .ngw_style_cache import NGWStyleCache
 from .action_style_import_or_update import ActionStyleImportUpdate
 from .dialog_choose_style import NGWLayerStyleChooserDialog
 from .dialog_qgis_proj_import import DialogImportQGISProj
@@ -80,7 +79,10 @@ from .dialog_metadata import MetadataDialog
 from .exceptions_list_dialog import ExceptionsListDialog
 from .plugin_settings import PluginSettings
 from .settings_dialog import SettingsDialog
-from .tree_widget import QNGWResourceTreeView, QNGWResourceItem, QNGWResourceTreeModel
+from .tree_widget import (
+    QJobDashboard, QNGWResourceTreeView, QNGWResourceItem, QNGWResourceTreeModel,
+)
+from .tree_widget.cache import NGWResourceTreeCache
 
 
 this_dir = os.path.dirname(__file__)
@@ -122,8 +124,6 @@ class TreeControl(QMainWindow, FORM_CLASS):
         self.setupUi(self)
         self.iface = iface
 
-        self._first_gui_block_on_refresh = False
-
         self.actionOpenInNGW = QAction(self.tr("Open in WebGIS"), self)
         self.actionOpenInNGW.triggered.connect(self.open_ngw_resource_page)
 
@@ -169,6 +169,9 @@ class TreeControl(QMainWindow, FORM_CLASS):
             self.tr("Create resource group"), self)
         self.actionCreateNewGroup.triggered.connect(self.create_group)
 
+        self.actionExpandAll = QAction(self.tr("Expand all"), self)
+        self.actionExpandAll.triggered.connect(self.expand_all)
+
         self.actionCreateWebMap4Layer = QAction(self.tr("Create web Map"), self)
         self.actionCreateWebMap4Layer.triggered.connect(self.create_web_map_for_layer)
 
@@ -239,13 +242,14 @@ class TreeControl(QMainWindow, FORM_CLASS):
         self._resource_model = QNGWResourceTreeModel(self)
         self._resource_model.errorOccurred.connect(self.__model_error_process)
         self._resource_model.warningOccurred.connect(self.__model_warning_process)
-        self._resource_model.jobStarted.connect(self.__modelJobStarted)
-        self._resource_model.jobStatusChanged.connect(self.__modelJobStatusChanged)
+        self._resource_model.jobStatusAggregator().jobsChanged.connect(self.__modelJobsChanged)
+        self._resource_model.jobScheduler().metricsChanged.connect(self.__modelJobMetricsChanged)
         self._resource_model.jobFinished.connect(self.__modelJobFinished)
-        self._resource_model.indexesLocked.connect(self.__onModelBlockIndexes)
-        self._resource_model.indexesUnlocked.connect(self.__onModelReleaseIndexes)
+        self._resource_model.indexesLocked.connect(self.checkImportActionsAvailability)
+        self._resource_model.indexesUnlocked.connect(self.checkImportActionsAvailability)
 
-        self.blocked_jobs = {
+        # Jobs shown in the job dashboard
+        self.job_titles = {
             "NGWGroupCreater": self.tr("Resource is being created"),
             "NGWResourceDelete": self.tr("Resource is being deleted"),
             "QGISResourcesImporter": self.tr("Layer is being imported"),
@@ -258,6 +262,10 @@ class TreeControl(QMainWindow, FORM_CLASS):
             "QGISStyleAdder": self.tr("Style for layer is being created"),
             "NGWRenameResource": self.tr("Resource is being renamed"),
             "NGWUpdateVectorLayer": self.tr("Resource is being updated"),
+            "NGWResourceCopier": self.tr("Resource is being copied"),
+            "NGWRootResourcesLoader": self.tr("Resources are being loaded"),
+            "NGWResourceUpdater": self.tr("Group is being loaded"),
+            "NGWSubtreeLoader": self.tr("Group is being loaded"),
         }
 
         # ngw resources view
@@ -267,11 +275,24 @@ class TreeControl(QMainWindow, FORM_CLASS):
         self.trvResources.customContextMenuRequested.connect(self.slotCustomContextMenu)
         self.trvResources.itemDoubleClicked.connect(self.trvDoubleClickProcess)
         self.trvResources.selectionModel().currentChanged.connect(self.checkImportActionsAvailability)
+        self.trvResources.expanded.connect(self.__onIndexExpanded)
+        self.trvResources.collapsed.connect(self.__onIndexCollapsed)
 
         self.nrw_reorces_tree_container.addWidget(self.trvResources)
 
+        # Operations lock only the resources they change, their progress
+        # is shown below the tree
+        self.jobDashboard = QJobDashboard(self)
+        self.jobDashboard.cancelRequested.connect(self.__cancel_dashboard_job)
+        self.jobDashboard.hide()
+        self.nrw_reorces_tree_container.addWidget(self.jobDashboard)
+
         self.jobs_count = 0
         self.try_check_https = False
+        self._ngw_session = None
+        self._style_cache = NGWStyleCache(self)
+        # Style requests have no parent, they are kept here until they end
+        self._style_requests = set()
 
         self.iface.initializationCompleted.connect(self.reinit_tree)
         # update state
@@ -290,6 +311,9 @@ class TreeControl(QMainWindow, FORM_CLASS):
         self.trvResources.customContextMenuRequested.disconnect(self.slotCustomContextMenu)
         self.trvResources.itemDoubleClicked.disconnect(self.trvDoubleClickProcess)
         self.trvResources.selectionModel().currentChanged.disconnect(self.checkImportActionsAvailability)
+        self.trvResources.expanded.disconnect(self.__onIndexExpanded)
+        self.trvResources.collapsed.disconnect(self.__onIndexCollapsed)
+        self.jobDashboard.cancelRequested.disconnect(self.__cancel_dashboard_job)
 
         self.trvResources.setParent(None)
         self.trvResources.deleteLater()
@@ -302,13 +326,17 @@ class TreeControl(QMainWindow, FORM_CLASS):
 
         self._resource_model.errorOccurred.disconnect(self.__model_error_process)
         self._resource_model.warningOccurred.disconnect(self.__model_warning_process)
-        self._resource_model.jobStarted.disconnect(self.__modelJobStarted)
-        self._resource_model.jobStatusChanged.disconnect(self.__modelJobStatusChanged)
+        self._resource_model.jobStatusAggregator().jobsChanged.disconnect(self.__modelJobsChanged)
+        self._resource_model.jobScheduler().metricsChanged.disconnect(self.__modelJobMetricsChanged)
         self._resource_model.jobFinished.disconnect(self.__modelJobFinished)
-        self._resource_model.indexesLocked.disconnect(self.__onModelBlockIndexes)
-        self._resource_model.indexesUnlocked.disconnect(self.__onModelReleaseIndexes)
+        self._resource_model.indexesLocked.disconnect(self.checkImportActionsAvailability)
+        self._resource_model.indexesUnlocked.disconnect(self.checkImportActionsAvailability)
 
+        self._resource_model.shutdown()
         self._resource_model.setParent(None)
+        NGWResourceTreeCache.shutdownWriter()
+
+        NGWSession.closeAll()
         self._resource_model.deleteLater()
         del self._resource_model
 
@@ -321,16 +349,22 @@ class TreeControl(QMainWindow, FORM_CLASS):
             ngw_resource = index.data(QNGWResourceItem.NGWResourceRole)
         else:
             ngw_resource = None
+        # Resources changed by running jobs can't be changed by other actions
+        is_locked = index is not None and index.isValid() and self._resource_model.isIndexLocked(index)
 
         self.actionImportQGISResource.setEnabled(
+            not is_locked and
             isinstance(current_qgis_layer, (QgsVectorLayer, QgsRasterLayer, QgsPluginLayer))
         )
 
         self.actionUpdateNGWVectorLayer.setEnabled(
-            isinstance(current_qgis_layer, QgsVectorLayer)
+            not is_locked and isinstance(current_qgis_layer, QgsVectorLayer)
         )
 
-        if isinstance(ngw_resource, NGWQGISVectorStyle) or isinstance(ngw_resource, NGWQGISRasterStyle):
+        if is_locked:
+            self.actionUpdateStyle.setEnabled(False)
+            self.actionAddStyle.setEnabled(False)
+        elif isinstance(ngw_resource, NGWQGISVectorStyle) or isinstance(ngw_resource, NGWQGISRasterStyle):
             ngw_layer = index.parent().data(QNGWResourceItem.NGWResourceRole)
             self.actionUpdateStyle.setEnabledByType(current_qgis_layer, ngw_layer)
             self.actionAddStyle.setEnabled(False)
@@ -338,7 +372,8 @@ class TreeControl(QMainWindow, FORM_CLASS):
             self.actionUpdateStyle.setEnabled(False)
             self.actionAddStyle.setEnabledByType(current_qgis_layer, ngw_resource)
 
-        self.actionImportQGISProject.setEnabled(QgsProject.instance().count() != 0)
+        self.actionImportQGISProject.setEnabled(not is_locked and QgsProject.instance().count() != 0)
+        self.actionCreateNewGroup.setEnabled(not is_locked)
 
         self.toolbuttonImport.setEnabled(
             (self.actionImportQGISResource.isEnabled() or self.actionImportQGISProject.isEnabled() or
@@ -506,35 +541,29 @@ class TreeControl(QMainWindow, FORM_CLASS):
         self.iface.messageBar().popWidget()
         self.iface.openMessageLog()
 
-    def __modelJobStarted(self, job_id):
-        if job_id in self.blocked_jobs:
-            self.block_gui()
-            self.trvResources.addBlockedJob(self.blocked_jobs[job_id])
+    def __modelJobsChanged(self, jobs):
+        dashboard_jobs = [
+            (self.job_titles[job["job_id"]], job)
+            for job in jobs if job["job_id"] in self.job_titles
+        ]
+        self.jobDashboard.setJobs(dashboard_jobs)
+        self.jobDashboard.setVisible(len(dashboard_jobs) > 0)
 
-    def __modelJobStatusChanged(self, job_id, status):
-        if job_id in self.blocked_jobs:
-            self.trvResources.addJobStatus(self.blocked_jobs[job_id], status)
+    def __modelJobMetricsChanged(self):
+        self.jobDashboard.setMetrics(self._resource_model.jobScheduler().metrics())
 
     def __modelJobFinished(self, job_id):
+        if job_id == 'NGWVersionProbe':
+            return # background probe must not be taken for the very first job
+
         self.jobs_count += 1 # note: __modelJobFinished will be triggered even if error/warning occured during job execution
         ngwApiLog('Jobs finished for current connection: {}'.format(self.jobs_count))
 
         if job_id == 'NGWRootResourcesLoader':
             self.unblock_gui()
 
-        if job_id in self.blocked_jobs:
-            self.unblock_gui()
-            self.trvResources.removeBlockedJob(self.blocked_jobs[job_id])
-
-    def __onModelBlockIndexes(self):
-        self.block_gui()
-
-    def __onModelReleaseIndexes(self):
-        if self._first_gui_block_on_refresh:
-            self._first_gui_block_on_refresh = False
-        else:
-            self.unblock_gui()
-
+    def __cancel_dashboard_job(self, job):
+        self._resource_model.cancelJob(job)
 
     def block_gui(self):
         self.main_tool_bar.setEnabled(False)
@@ -597,10 +626,22 @@ class TreeControl(QMainWindow, FORM_CLASS):
             if not self._resource_model.isCurruntConnectionSameWoProtocol(conn_sett):
                 self.jobs_count = 0 # start working with connection at very first time
 
-            self._first_gui_block_on_refresh = True
             self.block_gui() # block GUI to prevent extra clicks on toolbuttons
-            ngw_connection = QgsNgwConnection(conn_sett)
-            self._resource_model.resetModel(ngw_connection)
+            # Connection and HTTP sessions are shared by jobs and downloads
+            self._ngw_session = NGWSession.forConnection(conn_sett)
+            ngw_connection = self._ngw_session.connection()
+            self._resource_model.resetModel(
+                ngw_connection, NGWResourceTreeCache.forConnection(conn_sett), conn_sett
+            )
+
+            if self._resource_model.rowCount(QModelIndex()) > 0:
+                # Tree is restored from the cache and revalidated in background
+                self.unblock_gui()
+                for index in self._resource_model.expandedIndexes():
+                    self.trvResources.setExpanded(index, True)
+        else:
+            # Tree is kept, tools follow the current selection again
+            self.checkImportActionsAvailability()
 
         # expand root item
         # self.trvResources.setExpanded(self._resource_model.index(0, 0, QModelIndex()), True)
@@ -608,26 +649,17 @@ class TreeControl(QMainWindow, FORM_CLASS):
         # save last selected connection
         # NgwPluginSettings.set_selected_ngw_connection_name(name_of_conn)
 
-    def __action_refresh_tree(self):
-        self.reinit_tree(True)
+    def __onIndexExpanded(self, index):
+        self._resource_model.setIndexExpanded(index, True)
 
-    def __add_resource_to_tree(self, ngw_resource):
-        # TODO: fix duplicate with model.processJobResult
-        if ngw_resource.common.parent is None:
-            index = QModelIndex()
-            self._resource_model.addNGWResourceToTree(index, ngw_resource)
-        else:
-            index = self._resource_model.getIndexByNGWResourceId(
-                ngw_resource.common.parent.id,
-            )
+    def __onIndexCollapsed(self, index):
+        self._resource_model.setIndexExpanded(index, False)
 
-            item = index.internalPointer()
-            current_ids = [
-                item.child(i).data(QNGWResourceItem.NGWResourceRole).common.id
-                for i in range(item.childCount())
-                if isinstance(item.child(i), QNGWResourceItem)]
-            if ngw_resource.common.id not in current_ids:
-                self._resource_model.addNGWResourceToTree(index, ngw_resource)
+    def __action_refresh_tree(self):
+        # Loaded tree is refreshed in place to keep expansion, selection and
+        # scroll position
+        if not self._resource_model.refreshTree():
+            self.reinit_tree(True)
 
     def disable_tools(self):
         self.actionExport.setEnabled(False)
@@ -648,6 +680,9 @@ class TreeControl(QMainWindow, FORM_CLASS):
                 'Debug messages are now %s' % ('enabled' if debug_mode else 'disabled'),
                 PluginSettings._product, level=Qgis.Info)
 
+        self._resource_model.jobScheduler().setMaxConcurrency(PluginSettings.max_concurrent_jobs())
+
+        # Tree is reloaded only if the connection itself was changed
         self.reinit_tree()
 
     def action_help(self):
@@ -674,7 +709,7 @@ class TreeControl(QMainWindow, FORM_CLASS):
                 QModelIndex()
             )
 
-        if index.internalPointer().locked:
+        if self._resource_model.isIndexLocked(index):
             return
 
         ngw_resource = index.data(QNGWResourceItem.NGWResourceRole)
@@ -688,6 +723,7 @@ class TreeControl(QMainWindow, FORM_CLASS):
         creating_actions.extend([self.actionEditMetadata])
 
         if isinstance(ngw_resource, NGWGroupResource):
+            getting_actions.append(self.actionExpandAll)
             creating_actions.append(self.actionCreateNewGroup)
         elif isinstance(ngw_resource, NGWVectorLayer):
             getting_actions.extend([self.actionExport])
@@ -911,6 +947,16 @@ class TreeControl(QMainWindow, FORM_CLASS):
             self.trvResources.setCurrentIndex
         )
 
+    def expand_all(self):
+        sel_index = self.trvResources.selectionModel().currentIndex()
+        if not sel_index.isValid():
+            sel_index = self._resource_model.index(0, 0, QModelIndex())
+
+        self.expand_all_resp = self._resource_model.loadSubtree(sel_index)
+        self.expand_all_resp.done.connect(
+            self.trvResources.expandRecursively
+        )
+
     def import_qgis_project(self):
         sel_index = self.trvResources.selectionModel().currentIndex()
 
@@ -1052,131 +1098,9 @@ class TreeControl(QMainWindow, FORM_CLASS):
                 self.trvResources.setCurrentIndex
             )
 
-    def _downloadRasterSource(self, ngw_lyr, raster_file=None):
-        ''' Download raster layer source file
-            using QNetworkAccessManager.
-            Download and write file by chunks
-            using readyRead signal
-
-            return QFile object
-        '''
-        if not raster_file:
-            raster_file = QTemporaryFile()
-        else:
-            raster_file = QFile(raster_file)
-
-        url = '{}/download'.format(ngw_lyr.get_absolute_api_url())
-        def write_chuck():
-            if reply.error():
-                raise Exception('{} {}'.format(self.tr('Failed to download raster source:'), reply.errorString()))
-            data = reply.readAll()
-            log('Write chunk! Size: {}'.format(data.size()))
-            raster_file.write(data)
-
-        req = QNetworkRequest(QUrl(url))
-        creds = ngw_lyr.get_creds()
-        if creds is not None:
-            creds_str = creds[0] + ':' + creds[1]
-            authstr = creds_str.encode('utf-8')
-            authstr = QByteArray(authstr).toBase64()
-            authstr = QByteArray(('Basic ').encode('utf-8')).append(authstr)
-            req.setRawHeader(("Authorization").encode('utf-8'), authstr)
-
-        if raster_file.open(QIODevice.WriteOnly):
-
-            ev_loop = QEventLoop()
-            dwn_qml_manager = QNetworkAccessManager()
-
-            # dwn_qml_manager.finished.connect(ev_loop.quit)
-            reply = dwn_qml_manager.get(req)
-
-            reply.readyRead.connect(write_chuck)
-            reply.finished.connect(ev_loop.quit)
-
-            ev_loop.exec_()
-
-            write_chuck()
-            raster_file.close()
-            reply.deleteLater()
-
-            return raster_file
-        else:
-            raise Exception(self.tr("Can't open file to write raster!"))
-
-
-    def _copy_resource(self, ngw_src):
-        ''' Create a copy of a ngw raster or vector layer
-            1) Download ngw layer sources
-            2) Create QGIS hidden layer
-            3) Export layer to ngw
-            4) Add styles to new ngw layer
-        '''
-        def qml_callback(total_size, readed_size):
-            ngwApiLog(
-                'Style for "%s" - Upload (%d%%)' % (
-                    ngw_src.common.display_name,
-                    readed_size * 100 / total_size
-                )
-            )
-
-        style_resource = None
-
-        ngw_group = ngw_src.get_parent()
-        child_resources = ngw_src.get_children()
-        style_resources = []
-        # assume that there can be only a style of appropriate for the layer type
-        for child_resource in child_resources:
-            if (child_resource.type_id == NGWQGISVectorStyle.type_id or
-                child_resource.type_id == NGWQGISRasterStyle.type_id):
-                style_resources.append(child_resource)
-
-        # Download sources and create a QGIS layer
-        if ngw_src.type_id == NGWVectorLayer.type_id:
-            qgs_layer = QgsVectorLayer(
-                ngw_src.get_absolute_geojson_url(),
-                ngw_src.common.display_name,
-                'ogr'
-            )
-            if not qgs_layer.isValid():
-                raise Exception('Layer "%s" can\'t be added to the map!' % ngw_src.common.display_name)
-            qgs_layer.dataProvider().setEncoding('UTF-8')
-
-        elif ngw_src.type_id == NGWRasterLayer.type_id:
-            raster_file = self._downloadRasterSource(ngw_src)
-            qgs_layer = QgsRasterLayer(raster_file.fileName(), ngw_src.common.display_name, 'gdal')
-            if not qgs_layer.isValid():
-                log('Failed to add raster layer to QGIS')
-                raise Exception('Layer "%s" can\'t be added to the map!' % ngw_src.common.display_name)
-        else:
-            raise Exception('Wrong layer type! Type id: {}' % ngw_src.type_id)
-
-        # Export QGIS layer to NGW
-        resJob = QGISResourceJob()
-        ngw_res = resJob.importQGISMapLayer(qgs_layer, ngw_group)[0]
-
-        # Remove temp layer and sources
-        del qgs_layer
-        if ngw_src.type_id == NGWRasterLayer.type_id:
-            raster_file.remove()
-
-        # Export styles to new NGW layer
-        for style_resource in style_resources:
-            self._downloadStyleAsQML(style_resource, mes_bar=False)
-
-            ngw_style = ngw_res.create_qml_style(
-                self.dwn_qml_file.fileName(),
-                qml_callback,
-                style_name=style_resource.common.display_name
-            )
-            self.dwn_qml_file.remove()
-            ngw_res.update()
-
-        return ngw_res
-
     def copy_curent_ngw_resource(self):
-        ''' Copying the selected ngw resource.
-            Only GUI stuff here, main part
-            in _copy_resource function
+        ''' Copying the selected ngw resource
+            in background by the model job
         '''
         sel_index = self.trvResources.selectionModel().currentIndex()
         if sel_index.isValid():
@@ -1191,32 +1115,12 @@ class TreeControl(QMainWindow, FORM_CLASS):
             if res == QMessageBox.No:
                 return
 
-            ngw_resource = sel_index.data(QNGWResourceItem.NGWResourceRole)
-
-            # block gui
-            self.trvResources.ngw_job_block_overlay.show()
-            self.block_gui()
-            self.trvResources.ngw_job_block_overlay.text.setText(
-                "<strong>{} {}</strong><br/>".format(self.tr('Copying'), ngw_resource.common.display_name)
+            self.copy_resource_response = self._resource_model.copyResource(
+                sel_index, self._style_cache
+            )
+            self.copy_resource_response.done.connect(
+                self.trvResources.setCurrentIndex
             )
-            # main part
-            try:
-                ngw_result = self._copy_resource(ngw_resource)
-                self.__add_resource_to_tree(ngw_result)
-            except UnsupportedRasterTypeException:
-                self._show_unsupported_raster_err()
-            except Exception as ex:
-                error_mes = str(ex)
-                self.iface.messageBar().pushMessage(
-                    self.tr('Error'),
-                    error_mes,
-                    level=Qgis.Critical
-                )
-                qgisLog(error_mes, level=Qgis.Critical)
-
-            # unblock gui
-            self.trvResources.ngw_job_block_overlay.hide()
-            self.unblock_gui()
 
     def create_wfs_service(self):
         selected_index = self.trvResources.selectionModel().currentIndex()
@@ -1342,38 +1246,26 @@ class TreeControl(QMainWindow, FORM_CLASS):
 
 
     def _downloadStyleAsQML(self, ngw_style, qml_file=None, mes_bar=True):
-        if not qml_file:
-            self.dwn_qml_file = QTemporaryFile()
-        else:
-            self.dwn_qml_file = QFile(qml_file)
-
-        url = ngw_style.download_qml_url()
-
-        req = QNetworkRequest(QUrl(url))
-        creds = ngw_style.get_creds_for_qml()
-        if creds is not None:
-            creds_str = creds[0] + ':' + creds[1]
-            authstr = creds_str.encode('utf-8')
-            authstr = QByteArray(authstr).toBase64()
-            authstr = QByteArray(('Basic ').encode('utf-8')).append(authstr)
-            req.setRawHeader(("Authorization").encode('utf-8'), authstr)
-
-        ev_loop = QEventLoop()
-        dwn_qml_manager = QNetworkAccessManager()
-        dwn_qml_manager.finished.connect(ev_loop.quit)
-        reply = dwn_qml_manager.get(req)
-        ev_loop.exec_()
-
-        if reply.error():
-            ngwApiLog('Failed to download QML: {}'.format(reply.errorString()))
-
-        if self.dwn_qml_file.open(QIODevice.WriteOnly):
-            ngwApiLog('dwn_qml_file: {}'.format(self.dwn_qml_file.fileName()))
-            self.dwn_qml_file.write(reply.readAll())
-            self.dwn_qml_file.close()
+        ''' Get style QML through the style cache in background.
+            If qml_file is set, QML is copied there when it is got
+
+            return NGWStyleRequest object
+        '''
+        def on_done(cached_file):
+            self._style_requests.discard(style_request)
+            ngwApiLog('QML of style {}: {}'.format(ngw_style.common.id, cached_file))
+            if qml_file:
+                try:
+                    shutil.copyfile(cached_file, qml_file)
+                except OSError as error:
+                    on_failed(str(error))
+                    return
             if mes_bar:
                 self.__msg_in_qgis_mes_bar(self.tr("QML file downloaded"), False, duration=2)
-        else:
+
+        def on_failed(error):
+            self._style_requests.discard(style_request)
+            ngwApiLog('Failed to download QML: {}'.format(error))
             if mes_bar:
                 self.__msg_in_qgis_mes_bar(
                     self.tr("QML file could not be downloaded"),
@@ -1381,7 +1273,11 @@ class TreeControl(QMainWindow, FORM_CLASS):
                     Qgis.Critical
                 )
 
-        reply.deleteLater()
+        style_request = self._style_cache.fetch(self._ngw_session, ngw_style)
+        self._style_requests.add(style_request)
+        style_request.done.connect(on_done)
+        style_request.failed.connect(on_failed)
+        return style_request
 
 
     def downloadQML(self):
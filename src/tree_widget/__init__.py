@@ -1,9 +1,10 @@
 from .item import QModelItem, QNGWResourceItem
 from .model import QNGWResourceTreeModel
-from .view import QNGWResourceTreeView
+from .view import QJobDashboard, QNGWResourceTreeView
 
 
 __all__ = [
+    "QJobDashboard",
     "QModelItem",
     "QNGWResourceItem",
     "QNGWResourceTreeModel",
@@ -0,0 +1,184 @@
+import hashlib
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+from qgis.core import QgsApplication
+
+from ..ngw_api.utils import log
+from ..ngw_session import NGWSession
+
+
+__all__ = ["NGWResourceTreeCache"]
+
+
+class NGWResourceTreeCache:
+    """SQLite snapshot of the loaded resource tree of one NGW connection.
+
+    Rows are ordered by depth, so a parent always precedes its children.
+    Common fields of resources are kept to rebuild resource objects
+    without requests to the server, restored resources get the rest when
+    their group is listed again. Saves are serialized by a background
+    thread, and only rows whose content hash changed since the previous
+    save are written.
+    """
+
+    SCHEMA_VERSION = 1
+
+    # Single writer keeps writes of all caches in order
+    __writer = None
+
+    def __init__(self, path):
+        self.__path = path
+        # Content hashes of saved rows by resource id, None until the
+        # whole tree is written. Used by the writer thread only.
+        self.__saved_hashes = None
+        self.__last_write = None
+
+    @classmethod
+    def forConnection(cls, ngw_connection_settings):
+        key = NGWSession.connectionKey(ngw_connection_settings)
+        file_name = "tree_{}.sqlite".format(
+            hashlib.sha1(repr(key).encode("utf-8")).hexdigest()
+        )
+        return cls(os.path.join(cls.cacheDirectory(), file_name))
+
+    @classmethod
+    def shutdownWriter(cls):
+        """Write pending saves and stop the writer thread."""
+        if cls.__writer is not None:
+            cls.__writer.shutdown(wait=True)
+            cls.__writer = None
+
+    @staticmethod
+    def cacheDirectory():
+        return os.path.join(
+            QgsApplication.qgisSettingsDirPath(), "cache", "nextgis_connect"
+        )
+
+    def path(self):
+        return self.__path
+
+    def load(self):
+        """Return cached rows as (id, parent_id, children_count, expanded, resource_json)."""
+        if not os.path.exists(self.__path):
+            return []
+
+        try:
+            with closing(self.__connect()) as connection:
+                version = connection.execute("PRAGMA user_version").fetchone()[0]
+                if version != self.SCHEMA_VERSION:
+                    return []
+                rows = connection.execute(
+                    """
+                    SELECT id, parent_id, children_count, expanded, resource_json
+                    FROM resources
+                    ORDER BY position, id
+                    """
+                ).fetchall()
+        except sqlite3.Error as error:
+            log("Failed to read resource tree cache: {}".format(error))
+            return []
+
+        return [
+            (row[0], row[1], row[2], bool(row[3]), json.loads(row[4]))
+            for row in rows
+        ]
+
+    def save(self, rows):
+        """Write the tree in background.
+
+        Every row is (id, parent_id, type, display_name, children_count,
+        expanded, resource_fields, depth), where resource_fields is a dict
+        of the common fields of the resource. It must not be changed after
+        the call.
+        """
+        if NGWResourceTreeCache.__writer is None:
+            NGWResourceTreeCache.__writer = ThreadPoolExecutor(max_workers=1)
+        self.__last_write = NGWResourceTreeCache.__writer.submit(self.__write, rows)
+
+    def wait(self):
+        """Block until the last save is written."""
+        if self.__last_write is not None:
+            self.__last_write.result()
+
+    def __write(self, rows):
+        try:
+            records = {}
+            hashes = {}
+            for row in rows:
+                resource_json = json.dumps({"resource": row[6]}, default=vars, sort_keys=True)
+                record = (row[7], row[0], row[1], row[2], row[3], row[4], int(row[5]), resource_json)
+                records[row[0]] = record
+                hashes[row[0]] = hashlib.sha1(repr(record).encode("utf-8")).digest()
+
+            if self.__saved_hashes is None:
+                changed_records = list(records.values())
+                deleted_ids = None  # table is replaced
+            else:
+                changed_records = [
+                    record for ngw_resource_id, record in records.items()
+                    if self.__saved_hashes.get(ngw_resource_id) != hashes[ngw_resource_id]
+                ]
+                deleted_ids = [
+                    ngw_resource_id for ngw_resource_id in self.__saved_hashes
+                    if ngw_resource_id not in records
+                ]
+                if len(changed_records) == 0 and len(deleted_ids) == 0:
+                    return
+
+            os.makedirs(os.path.dirname(self.__path), exist_ok=True)
+            with closing(self.__connect()) as connection, connection:
+                self.__createSchema(connection)
+                if deleted_ids is None:
+                    connection.execute("DELETE FROM resources")
+                else:
+                    connection.executemany(
+                        "DELETE FROM resources WHERE id = ?",
+                        ((ngw_resource_id,) for ngw_resource_id in deleted_ids)
+                    )
+                connection.executemany(
+                    """
+                    INSERT OR REPLACE INTO resources (
+                        position, id, parent_id, type, display_name,
+                        children_count, expanded, resource_json
+                    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    """,
+                    changed_records
+                )
+            self.__saved_hashes = hashes
+        except (OSError, sqlite3.Error, TypeError, ValueError) as error:
+            log("Failed to write resource tree cache: {}".format(error))
+            # Next save writes the whole tree
+            self.__saved_hashes = None
+
+    def clear(self):
+        try:
+            os.remove(self.__path)
+        except OSError:
+            pass
+
+    def __connect(self):
+        return sqlite3.connect(self.__path)
+
+    def __createSchema(self, connection):
+        version = connection.execute("PRAGMA user_version").fetchone()[0]
+        if version != self.SCHEMA_VERSION:
+            connection.execute("DROP TABLE IF EXISTS resources")
+        connection.execute(
+            """
+            CREATE TABLE IF NOT EXISTS resources (
+                position INTEGER NOT NULL,
+                id INTEGER PRIMARY KEY,
+                parent_id INTEGER,
+                type TEXT NOT NULL,
+                display_name TEXT,
+                children_count INTEGER,
+                expanded INTEGER NOT NULL DEFAULT 0,
+                resource_json TEXT NOT NULL
+            )
+            """
+        )
+        connection.execute("PRAGMA user_version = {}".format(self.SCHEMA_VERSION))
@@ -1,5 +1,5 @@
 from qgis.PyQt.QtCore import Qt, QVariant
-from qgis.PyQt.QtGui import QIcon
+from qgis.PyQt.QtGui import QGuiApplication, QIcon
 
 from ..ngw_api.core import (
     NGWGroupResource, NGWMapServerStyle, NGWQGISRasterStyle, NGWQGISVectorStyle,
@@ -7,34 +7,112 @@ from ..ngw_api.core import (
 from ..ngw_api.utils import log  # TODO REMOVE
 
 
-from qgis.PyQt.QtWidgets import QTreeWidgetItem
+# Icons are shared by all items of the same resource type
+_icons_cache = {}
 
 
-# TODO: remove QTreeWidgetItem inheritance
-class QModelItem(QTreeWidgetItem):
+def cached_icon(icon_path):
+    app = QGuiApplication.instance()
+    pixel_ratio = app.devicePixelRatio() if app is not None else 1.0
+    key = (icon_path, pixel_ratio)
+    icon = _icons_cache.get(key)
+    if icon is None:
+        icon = QIcon(icon_path)
+        _icons_cache[key] = icon
+    return icon
+
+
+class QModelItem:
+    __slots__ = ("_parent", "_children", "_row", "_children_rows_valid", "_locked")
+
     def __init__(self):
-        super().__init__()
+        self._parent = None
+        self._children = []
 
-        #self.locked_item = ItemBase(["loading..."])
-        #self.locked_item.setFlags(Qt.NoItemFlags)
+        # Position of the item in its parent. Children positions are
+        # recalculated lazily after structural changes of the parent.
+        self._row = 0
+        self._children_rows_valid = True
 
         self._locked = False
-        self.unlock()
+
+    def parent(self):
+        return self._parent
+
+    def child(self, index):
+        if 0 <= index < len(self._children):
+            return self._children[index]
+        return None
+
+    def childCount(self):
+        return len(self._children)
+
+    def children(self):
+        return self._children
+
+    def indexOfChild(self, child):
+        if child._parent is not self:
+            return -1
+        return child.row()
+
+    def insertChild(self, index, child):
+        child._parent = self
+        self._children.insert(index, child)
+        self._children_rows_valid = False
+
+    def insertChildren(self, index, children):
+        for child in children:
+            child._parent = self
+        self._children[index:index] = children
+        self._children_rows_valid = False
+
+    def addChild(self, child):
+        child._row = len(self._children)
+        child._parent = self
+        self._children.append(child)
+
+    def removeChild(self, child):
+        index = self.indexOfChild(child)
+        if index != -1:
+            self.takeChild(index)
+
+    def takeChildren(self, index, count):
+        children = self._children[index:index + count]
+        del self._children[index:index + count]
+        for child in children:
+            child._parent = None
+        self._children_rows_valid = False
+        return children
+
+    def takeChild(self, index):
+        child = self._children.pop(index)
+        child._parent = None
+        self._children_rows_valid = False
+        return child
+
+    def row(self):
+        parent = self._parent
+        if parent is None:
+            return 0
+        parent._updateChildrenRows()
+        return self._row
+
+    def _updateChildrenRows(self):
+        if self._children_rows_valid:
+            return
+        for i, child in enumerate(self._children):
+            child._row = i
+        self._children_rows_valid = True
 
     def lock(self):
         self._locked = True
-        #self.setFlags(Qt.NoItemFlags)
-        #self.addChild(self.locked_item)
 
     @property
     def locked(self):
         return self._locked
 
     def unlock(self):
-        if self._locked:
-            #self.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
-            #self.removeChild(self.locked_item)
-            self._locked = False
+        self._locked = False
 
     def flags(self):
         if self._locked:
@@ -46,11 +124,16 @@ class QModelItem(QTreeWidgetItem):
 
 
 class QNGWResourceItem(QModelItem):
+    __slots__ = ("_title", "_ngw_resource", "_sort_key")
+
     NGWResourceRole = Qt.UserRole
     NGWResourceIdRole = Qt.UserRole + 1
 
     def __init__(self, ngw_resource):
         super().__init__()
+        self.setNGWResource(ngw_resource)
+
+    def setNGWResource(self, ngw_resource):
         title = ngw_resource.common.display_name
         if isinstance(ngw_resource, (NGWQGISRasterStyle, NGWQGISVectorStyle)):
             title = "(qgis) " + title
@@ -58,13 +141,14 @@ class QNGWResourceItem(QModelItem):
             title = "(ms) " + title
         self._title = title
         self._ngw_resource = ngw_resource
-        self._icon = QIcon(self._ngw_resource.icon_path)
+        # Groups go first, then items are ordered by title
+        self._sort_key = (not self.is_group(), title.lower())
 
     def data(self, role):
         if role == Qt.DisplayRole:
             return self._title
         if role == Qt.DecorationRole:
-            return self._icon
+            return cached_icon(self._ngw_resource.icon_path)
         if role == QNGWResourceItem.NGWResourceRole:
             return self._ngw_resource
         if role == QNGWResourceItem.NGWResourceIdRole:
@@ -78,11 +162,11 @@ class QNGWResourceItem(QModelItem):
         ngw_resource = self.data(self.NGWResourceRole)
         return ngw_resource.type_id == NGWGroupResource.type_id
 
+    def sort_key(self):
+        return self._sort_key
+
     def more_priority(self, item):
         if not isinstance(item, QNGWResourceItem):
             return True
 
-        if self.is_group() != item.is_group():
-            return self.is_group() > item.is_group()
-
-        return self._title.lower() < item._title.lower()
+        return self._sort_key < item._sort_key
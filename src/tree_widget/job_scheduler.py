@@ -0,0 +1,199 @@
+import heapq
+import itertools
+import time
+
+from qgis.PyQt.QtCore import QCoreApplication, QObject, QThread, pyqtSignal, pyqtSlot
+
+from ..ngw_api.utils import log
+
+
+__all__ = ["NGWJobCancellationToken", "NGWJobScheduler"]
+
+
+class NGWJobCancellationToken:
+    """Cancellation flag shared by a job and its worker.
+
+    Workers check it between steps and stop early when it is set.
+    """
+
+    def __init__(self):
+        self.__cancelled = False
+
+    def cancel(self):
+        self.__cancelled = True
+
+    def isCancelled(self):
+        return self.__cancelled
+
+
+class NGWJobRunner(QObject):
+    """Runs workers one by one in its own long-living thread."""
+
+    runRequested = pyqtSignal(object)
+
+    def __init__(self):
+        super().__init__()
+        self.__thread = QThread()
+        self.moveToThread(self.__thread)
+        self.runRequested.connect(self.run)
+        self.__thread.start()
+
+    @pyqtSlot(object)
+    def run(self, worker):
+        try:
+            worker.run()
+        finally:
+            # Return the worker to the main thread, so it is safely deleted
+            # together with its job
+            worker.moveToThread(QCoreApplication.instance().thread())
+
+    def stop(self, timeout=None):
+        """Stop the thread, return False if it is still running a worker."""
+        self.__thread.quit()
+        if timeout is None:
+            return self.__thread.wait()
+        return self.__thread.wait(timeout)
+
+
+class NGWJobScheduler(QObject):
+    """Runs model jobs on a bounded pool of worker threads.
+
+    Queued jobs are started by priority, jobs with equal priority are
+    started in order of scheduling.
+    """
+
+    PriorityInteractive = 0
+    PriorityNormal = 1
+    PriorityBulk = 2
+    PriorityBackground = 3
+
+    # Time given to running jobs to stop on shutdown, in milliseconds
+    SHUTDOWN_TIMEOUT = 3000
+
+    metricsChanged = pyqtSignal()
+
+    # Runners that didn't stop on shutdown, kept until their thread ends
+    __detached_runners = []
+
+    def __init__(self, parent, max_concurrency=4):
+        super().__init__(parent)
+
+        self.__max_concurrency = max(max_concurrency, 1)
+        self.__idle_runners = []
+        self.__runners_count = 0
+        self.__running_jobs = {}
+
+        self.__queue = []
+        self.__queued_jobs = {}
+        self.__sequence = itertools.count()
+
+        self.__started_count = 0
+        self.__total_wait = 0.0
+        self.__max_wait = 0.0
+
+    def maxConcurrency(self):
+        return self.__max_concurrency
+
+    def setMaxConcurrency(self, max_concurrency):
+        self.__max_concurrency = max(max_concurrency, 1)
+        self.__startQueuedJobs()
+
+    def schedule(self, job, priority=PriorityNormal):
+        entry = [priority, next(self.__sequence), job, time.monotonic()]
+        self.__queued_jobs[job] = entry
+        heapq.heappush(self.__queue, entry)
+        self.__startQueuedJobs()
+        self.metricsChanged.emit()
+
+    def isQueued(self, job):
+        return job in self.__queued_jobs
+
+    def promote(self, job, priority):
+        """Raise priority of a queued job."""
+        entry = self.__queued_jobs.get(job)
+        if entry is None or entry[0] <= priority:
+            return
+        entry[2] = None
+        new_entry = [priority, next(self.__sequence), job, entry[3]]
+        self.__queued_jobs[job] = new_entry
+        heapq.heappush(self.__queue, new_entry)
+
+    def unschedule(self, job):
+        """Remove a job from the queue. Return False if it is not queued."""
+        entry = self.__queued_jobs.pop(job, None)
+        if entry is None:
+            return False
+        entry[2] = None
+        self.metricsChanged.emit()
+        return True
+
+    def __startQueuedJobs(self):
+        while len(self.__queue) > 0 and len(self.__running_jobs) < self.__max_concurrency:
+            priority, _, job, queued_at = heapq.heappop(self.__queue)
+            if job is None:
+                continue  # entry was removed from the queue
+            del self.__queued_jobs[job]
+
+            wait_time = time.monotonic() - queued_at
+            self.__started_count += 1
+            self.__total_wait += wait_time
+            self.__max_wait = max(self.__max_wait, wait_time)
+            log("Job {} started after {:.3f} s in queue".format(job.getJobId(), wait_time))
+
+            runner = self.__takeRunner()
+            self.__running_jobs[job] = runner
+            job.finished.connect(self.__jobFinished)
+            job.start(runner)
+
+    def __takeRunner(self):
+        if len(self.__idle_runners) > 0:
+            return self.__idle_runners.pop()
+        self.__runners_count += 1
+        return NGWJobRunner()
+
+    def __jobFinished(self):
+        job = self.sender()
+        job.finished.disconnect(self.__jobFinished)
+
+        runner = self.__running_jobs.pop(job, None)
+        if runner is not None:
+            self.__idle_runners.append(runner)
+
+        self.__startQueuedJobs()
+        self.metricsChanged.emit()
+
+    def metrics(self):
+        started_count = self.__started_count
+        return {
+            "queue_depth": len(self.__queued_jobs),
+            "running": len(self.__running_jobs),
+            "threads": self.__runners_count,
+            "max_concurrency": self.__max_concurrency,
+            "started": started_count,
+            "average_wait": self.__total_wait / started_count if started_count > 0 else 0.0,
+            "max_wait": self.__max_wait,
+        }
+
+    def shutdown(self):
+        """Cancel running jobs and stop the threads.
+
+        Jobs that don't check their cancellation token are not waited for
+        longer than SHUTDOWN_TIMEOUT, their threads are left to end alone.
+        """
+        self.__queue = []
+        self.__queued_jobs = {}
+
+        for job in self.__running_jobs:
+            job.cancel()
+
+        runners = self.__idle_runners + list(self.__running_jobs.values())
+        self.__idle_runners = []
+        self.__running_jobs = {}
+        deadline = time.monotonic() + self.SHUTDOWN_TIMEOUT / 1000
+        for runner in runners:
+            timeout = max(int((deadline - time.monotonic()) * 1000), 0)
+            if not runner.stop(timeout):
+                log("Job thread is still running on shutdown")
+                NGWJobScheduler.__detached_runners.append(runner)
+        self.__runners_count = 0
+        self.metricsChanged.emit()
@@ -0,0 +1,158 @@
+import re
+import time
+
+from qgis.PyQt.QtCore import QObject, QTimer, pyqtSignal
+
+
+__all__ = ["NGWJobStatusAggregator"]
+
+
+class NGWJobStatusAggregator(QObject):
+    """Collects states of model jobs and delivers them at a limited rate.
+
+    Status and progress updates of a job overwrite each other, so only
+    the latest ones are delivered, no more than max_updates_per_second
+    times per second. Cancelled jobs stay in the list for
+    CANCELLED_VISIBLE_TIME after they finish.
+    """
+
+    StateQueued = "queued"
+    StateRunning = "running"
+    StateCancelling = "cancelling"
+    StateCancelled = "cancelled"
+
+    CANCELLED_VISIBLE_TIME = 3000
+
+    # Weight of the latest measurement in the smoothed transfer rate
+    RATE_SMOOTHING = 0.3
+
+    PERCENT_PATTERN = re.compile(r"(\d{1,3}(?:\.\d+)?)\s*%")
+
+    jobsChanged = pyqtSignal(list)
+    statusChanged = pyqtSignal(str, str)
+
+    def __init__(self, parent, max_updates_per_second=10):
+        super().__init__(parent)
+
+        self.__jobs = {}
+        self.__changed_statuses = {}
+
+        self.__timer = QTimer(self)
+        self.__timer.setSingleShot(True)
+        self.__timer.setInterval(int(1000 / max(max_updates_per_second, 1)))
+        self.__timer.timeout.connect(self.flush)
+
+    def jobQueued(self, job, cancellable=False):
+        """Add a job, cancellable tells if the running job can be cancelled.
+
+        Queued jobs can always be cancelled.
+        """
+        self.__jobs[job] = {
+            "job": job,
+            "job_id": job.getJobId(),
+            "state": self.StateQueued,
+            "cancellable": True,
+            "cancellable_when_running": cancellable,
+            "status": "",
+            "percent": None,
+            "done": None,
+            "total": None,
+            "rate": None,
+            "eta": None,
+            "updated_at": time.monotonic(),
+        }
+        self.__scheduleFlush()
+
+    def jobStarted(self, job):
+        entry = self.__jobs.get(job)
+        if entry is None:
+            return
+        if entry["state"] == self.StateQueued:
+            entry["state"] = self.StateRunning
+            entry["cancellable"] = entry["cancellable_when_running"]
+        entry["updated_at"] = time.monotonic()
+        self.__scheduleFlush()
+
+    def jobCancelling(self, job):
+        entry = self.__jobs.get(job)
+        if entry is None:
+            return
+        entry["state"] = self.StateCancelling
+        entry["cancellable"] = False
+        self.__scheduleFlush()
+
+    def jobStatusChanged(self, job, status):
+        entry = self.__jobs.get(job)
+        if entry is None:
+            return
+        entry["status"] = status
+        if entry["total"] is None:
+            match = self.PERCENT_PATTERN.search(status)
+            if match is not None:
+                entry["percent"] = min(float(match.group(1)), 100.0)
+        self.__changed_statuses[job] = status
+        self.__scheduleFlush()
+
+    def jobProgressChanged(self, job, done, total):
+        entry = self.__jobs.get(job)
+        if entry is None:
+            return
+
+        now = time.monotonic()
+        if entry["done"] is not None and now > entry["updated_at"]:
+            rate = max(done - entry["done"], 0) / (now - entry["updated_at"])
+            if entry["rate"] is not None:
+                rate = self.RATE_SMOOTHING * rate + (1 - self.RATE_SMOOTHING) * entry["rate"]
+            entry["rate"] = rate
+        entry["done"] = done
+        entry["total"] = total
+        entry["updated_at"] = now
+
+        if total:
+            entry["percent"] = 100.0 * done / total
+            if entry["rate"]:
+                entry["eta"] = max(total - done, 0) / entry["rate"]
+        self.__scheduleFlush()
+
+    def jobFinished(self, job):
+        self.__changed_statuses.pop(job, None)
+        entry = self.__jobs.get(job)
+        if entry is None:
+            return
+
+        if entry["state"] == self.StateCancelling:
+            entry["state"] = self.StateCancelled
+            removal_timer = QTimer(self)
+            removal_timer.setSingleShot(True)
+            removal_timer.timeout.connect(lambda: self.__removeJob(job))
+            removal_timer.timeout.connect(removal_timer.deleteLater)
+            removal_timer.start(self.CANCELLED_VISIBLE_TIME)
+        else:
+            del self.__jobs[job]
+        self.__scheduleFlush()
+
+    def jobs(self):
+        return [dict(entry) for entry in self.__jobs.values()]
+
+    def flush(self):
+        self.__timer.stop()
+
+        changed_statuses = self.__changed_statuses
+        self.__changed_statuses = {}
+        for job, status in changed_statuses.items():
+            self.statusChanged.emit(job.getJobId(), status)
+
+        self.jobsChanged.emit(self.jobs())
+
+    def clear(self):
+        self.__timer.stop()
+        self.__jobs = {}
+        self.__changed_statuses = {}
+
+    def __removeJob(self, job):
+        if self.__jobs.pop(job, None) is not None:
+            self.__scheduleFlush()
+
+    def __scheduleFlush(self):
+        if not self.__timer.isActive():
+            self.__timer.start()
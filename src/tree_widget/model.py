@@ -1,12 +1,22 @@
+import hashlib
+import time
+
 from qgis.PyQt.QtCore import (
-    QAbstractItemModel, QCoreApplication, QModelIndex, QObject, pyqtSignal, QThread, QVariant,
+    QAbstractItemModel, QModelIndex, QObject, pyqtSignal, Qt, QTimer, QVariant,
 )
 
 from ..ngw_api.core import NGWGroupResource
+from ..ngw_api.core.ngw_resource_factory import NGWResourceFactory
 from ..ngw_api.qt.qt_ngw_resource_model_job import NGWRootResourcesLoader, NGWResourceUpdater
 from ..ngw_api.utils import log  # TODO REMOVE
 
+from ..ngw_session import NGWSession
+from ..plugin_settings import PluginSettings
+
 from .item import QModelItem, QNGWResourceItem
+from .job_scheduler import NGWJobCancellationToken, NGWJobScheduler
+from .job_status import NGWJobStatusAggregator
+from .model_jobs import NGWResourceCopier, NGWSubtreeLoader, NGWVersionProbe
 
 
 __all__ = ["QNGWResourceTreeModel"]
@@ -18,6 +28,8 @@ class NGWResourcesModelJob(QObject):
     warningOccurred = pyqtSignal(object)
     errorOccurred = pyqtSignal(object)
     finished = pyqtSignal()
+    batchReceived = pyqtSignal(object)
+    progressChanged = pyqtSignal(object, object)
 
     def __init__(self, parent, worker):
         super().__init__(parent)
@@ -26,11 +38,23 @@ class NGWResourcesModelJob(QObject):
         self.__job_id = self.__worker.id
         self.__error = None
 
+        # Workers that support cancellation check the token between steps
+        self.__cancellation_token = NGWJobCancellationToken()
+        self.__worker.cancellation_token = self.__cancellation_token
+
         self.__worker.started.connect(self.started.emit)
         self.__worker.dataReceived.connect(self.__rememberResult)
         self.__worker.statusChanged.connect(self.statusChanged.emit)
         self.__worker.errorOccurred.connect(self.processJobError)
         self.__worker.warningOccurred.connect(self.processJobWarnings)
+        # Workers may emit parts of the result before they finish
+        self.__streams_batches = hasattr(self.__worker, "batchReceived")
+        if self.__streams_batches:
+            self.__worker.batchReceived.connect(self.batchReceived.emit)
+        # Workers may report transferred and total bytes
+        self.__reports_progress = hasattr(self.__worker, "progressChanged")
+        if self.__reports_progress:
+            self.__worker.progressChanged.connect(self.progressChanged.emit)
 
         self.model_response = None
 
@@ -47,9 +71,18 @@ class NGWResourcesModelJob(QObject):
     def getResult(self):
         return self.__result
 
+    def getWorker(self):
+        return self.__worker
+
     def error(self):
         return self.__error
 
+    def cancel(self):
+        self.__cancellation_token.cancel()
+
+    def isCancelled(self):
+        return self.__cancellation_token.isCancelled()
+
     def processJobError(self, job_error):
         self.__error = job_error
         self.errorOccurred.emit(job_error)
@@ -59,13 +92,11 @@ class NGWResourcesModelJob(QObject):
             self.model_response._warnings.append(job_error)
         # self.warningOccurred.emit(job_error)
 
-    def start(self):
-        self.__thread = QThread(self)
-        self.__worker.moveToThread(self.__thread)
+    def start(self, runner):
+        self.__worker.moveToThread(runner.thread())
         self.__worker.finished.connect(self.finishProcess)
-        self.__thread.started.connect(self.__worker.run)
 
-        self.__thread.start()
+        runner.runRequested.emit(self.__worker)
 
     def finishProcess(self):
         self.__worker.started.disconnect()
@@ -74,9 +105,24 @@ class NGWResourcesModelJob(QObject):
         self.__worker.errorOccurred.disconnect()
         self.__worker.warningOccurred.disconnect()
         self.__worker.finished.disconnect()
+        if self.__streams_batches:
+            self.__worker.batchReceived.disconnect()
+        if self.__reports_progress:
+            self.__worker.progressChanged.disconnect()
 
-        self.__thread.quit()
-        self.__thread.wait()
+        self.finished.emit()
+
+    def abort(self):
+        """Finish a job that was not started."""
+        self.__worker.started.disconnect()
+        self.__worker.dataReceived.disconnect()
+        self.__worker.statusChanged.disconnect()
+        self.__worker.errorOccurred.disconnect()
+        self.__worker.warningOccurred.disconnect()
+        if self.__streams_batches:
+            self.__worker.batchReceived.disconnect()
+        if self.__reports_progress:
+            self.__worker.progressChanged.disconnect()
 
         self.finished.emit()
 
@@ -92,6 +138,10 @@ class QNGWResourceTreeModelBase(QAbstractItemModel):
 
     ngw_version = None
 
+    # Time spent on inserting children per event loop turn, in seconds
+    POPULATION_TIME_BUDGET = 0.008
+    POPULATION_CHUNK_SIZE = 64
+
     def __init__(self, parent):
         super().__init__(parent)
 
@@ -99,27 +149,79 @@ class QNGWResourceTreeModelBase(QAbstractItemModel):
         self._ngw_connection = None
 
         self.jobs = []
+        # Jobs of a connection that is not loaded anymore, their results
+        # are ignored
+        self.__dropped_jobs = set()
+        self.__job_scheduler = NGWJobScheduler(self, PluginSettings.max_concurrent_jobs())
+        self.__job_status_aggregator = NGWJobStatusAggregator(self)
+        self.__job_status_aggregator.statusChanged.connect(self.jobStatusChanged.emit)
         self.root_item = QModelItem()
+        self.__items_by_ngw_resource_id = {}
+        # Sorted children of large groups that are not shown yet, stored
+        # in reverse order so the next page is popped from the end
+        self.__pending_children = {}
+
+        self.__tree_cache = None
+        self.__expanded_ids = set()
+        # Groups restored from the cache, their children are reloaded on fetch
+        self.__stale_items = set()
+        self.__children_listing_jobs = {}
+        self.__children_listing_jobs_by_parent = {}
+        # Background listings of subgroups, mapped to the remaining depth
+        self.__prefetch_depths = {}
+        self.__subtree_loading_jobs = {}
+        # Ids of resources added by result batches of running jobs
+        self.__streamed_resource_ids = {}
+        # Listed children that are being inserted progressively
+        self.__populations = {}
+        # Prefetch depths of groups that start prefetch once populated
+        self.__deferred_prefetches = {}
+        self.__population_timer = QTimer(self)
+        self.__population_timer.setInterval(0)
+        self.__population_timer.timeout.connect(self.__continuePopulations)
+
+        self.__cache_save_timer = QTimer(self)
+        self.__cache_save_timer.setSingleShot(True)
+        self.__cache_save_timer.setInterval(5000)
+        self.__cache_save_timer.timeout.connect(self.saveTreeCache)
+
+        self.__items_locked_by_jobs = {}
+        # Number of jobs holding the lock of every locked item
+        self.__item_lock_counts = {}
+        # Number of jobs that lock the whole subtree of an item
+        self.__subtree_lock_counts = {}
+        self.__items_locked_by_job_errors = {}
+
+        self.__version_probe_job = None
 
-        self.__indexes_locked_by_jobs = {}
-        self.__indexes_locked_by_job_errors = {}
-
-    # TODO: rework same connection identify
     def isCurrentConnectionSame(self, other):
-        return False
-        return self.__ngw_connection_settings == other
+        """Check that other settings connect to the loaded tree the same way.
+
+        URL, user, authentication method, proxy and secrets are compared,
+        other settings don't require to reload the tree.
+        """
+        return NGWSession.isSameConnection(self.__ngw_connection_settings, other)
 
     def isCurruntConnectionSameWoProtocol(self, other):
-        return False
-        if self.__ngw_connection_settings is None:
-            if other is None:
-                return True
-            return False
-        return self.__ngw_connection_settings.equalWoProtocol(other)
+        return NGWSession.isSameConnection(
+            self.__ngw_connection_settings, other, with_protocol=False
+        )
 
-    def resetModel(self, ngw_connection):
-        self.__indexes_locked_by_jobs = {}
-        self.__indexes_locked_by_job_errors = {}
+    def connectionSettings(self):
+        return self.__ngw_connection_settings
+
+    def resetModel(self, ngw_connection, tree_cache=None, ngw_connection_settings=None):
+        self.saveTreeCache()
+        self.__dropJobs()
+
+        self.__ngw_connection_settings = ngw_connection_settings
+
+        self.__items_locked_by_jobs = {}
+        # Number of jobs holding the lock of every locked item
+        self.__item_lock_counts = {}
+        # Number of jobs that lock the whole subtree of an item
+        self.__subtree_lock_counts = {}
+        self.__items_locked_by_job_errors = {}
 
         self._ngw_connection = ngw_connection
         self._ngw_connection.setParent(self)
@@ -128,20 +230,51 @@ class QNGWResourceTreeModelBase(QAbstractItemModel):
         self.beginResetModel()
 
         self.root_item = QModelItem()
-
-        # Get NGW version.
-        self._get_ngw_version()
+        self.__items_by_ngw_resource_id = {}
+        self.__pending_children = {}
+
+        self.__tree_cache = tree_cache
+        self.__expanded_ids = set()
+        self.__stale_items = set()
+        self.__children_listing_jobs = {}
+        self.__children_listing_jobs_by_parent = {}
+        self.__prefetch_depths = {}
+        self.__subtree_loading_jobs = {}
+        self.__streamed_resource_ids = {}
+        self.__populations = {}
+        self.__deferred_prefetches = {}
+        self.__population_timer.stop()
+
+        # Cached NGW version is used until the probe is finished
+        self.__version_probe_job = None
+        self.ngw_version = self._cachedNgwVersion()[0]
+
+        self._restoreFromCache()
 
         self.endResetModel()
         self.modelReset.emit()
 
+        self._probeNgwVersion()
+
+        if self.root_item.childCount() > 0:
+            self._revalidateRestoredTree()
+
     def cleanModel(self):
+        self.__dropJobs()
         self.__cleanModel()
 
+    def __dropJobs(self):
+        """Cancel jobs of the loaded connection and ignore their results."""
+        for job in list(self.jobs):
+            self.__dropped_jobs.add(job)
+            self.cancelJob(job)
+
     def __cleanModel(self):
+        self.__pending_children.pop(self.root_item, None)
         c = self.root_item.childCount()
         self.beginRemoveRows(QModelIndex(), 0, c - 1)
         for i in range(c - 1, -1, -1):
+            self._unregisterItem(self.root_item.child(i))
             self.root_item.removeChild(self.root_item.child(i))
         self.endRemoveRows()
 
@@ -163,14 +296,10 @@ class QNGWResourceTreeModelBase(QAbstractItemModel):
         parent_item = item.parent()
         if parent_item is self.root_item:
             return QModelIndex()
-        if parent_item is None:  # TODO: should not be without QTreeWidgetItem
+        if parent_item is None:  # item was removed from the tree
             return QModelIndex()
         assert parent_item is not None
-        return self.createIndex(
-            parent_item.parent().indexOfChild(parent_item),
-            0,
-            parent_item
-        )
+        return self.createIndex(parent_item.row(), 0, parent_item)
 
     def columnCount(self, parent):
         return 1
@@ -185,6 +314,11 @@ class QNGWResourceTreeModelBase(QAbstractItemModel):
 
         item = self.item(parent)
 
+        if item in self.__populations:
+            return False
+        if item in self.__pending_children or item in self.__stale_items:
+            return True
+
         if item is self.root_item:
             if self._ngw_connection is None:
                 return False
@@ -197,15 +331,26 @@ class QNGWResourceTreeModelBase(QAbstractItemModel):
     def fetchMore(self, parent):
         parent_item = self.item(parent)
         assert isinstance(parent_item, QModelItem)
-        if parent_item is self.root_item:
-            worker = NGWRootResourcesLoader(self._ngw_connection)
-        else:
-            ngw_resource = parent_item.data(QNGWResourceItem.NGWResourceRole)
-            worker = NGWResourceUpdater(ngw_resource)
-        self._startJob(worker, parent)
+        if parent_item in self.__pending_children:
+            if self._addPendingChildrenPage(parent) > 0 or not self.canFetchMore(parent):
+                return
+            # Nothing is inserted, so views won't ask for more again
+
+        self.__stale_items.discard(parent_item)
+        job = self._startChildrenListingJob(parent)
+        # Prefetch listing requested by the user prefetches at full depth
+        self.__prefetch_depths.pop(job, None)
 
     def data(self, index, role):
         item = self.item(index)
+        if role == Qt.DisplayRole and item in self.__populations:
+            population = self.__populations[item]
+            if population["inserted"] is None:
+                inserted, total = 0, len(population["resources"])
+            else:
+                # Only the first page of a large group is inserted
+                inserted, total = population["inserted"], len(population["items"])
+            return self.tr("{} (loading {} of {})").format(item.data(role), inserted, total)
         return item.data(role)
 
     def hasChildren(self, parent):
@@ -217,211 +362,1001 @@ class QNGWResourceTreeModelBase(QAbstractItemModel):
         return parent_item.childCount() > 0
 
     def flags(self, index):
+        if self.isIndexLocked(index):
+            return Qt.NoItemFlags
         item = self.item(index)
         return item.flags()
 
-    # TODO job должен уметь не стартовать, например есди запущен job обновления дочерних ресурсов - нельзя запускать обновление
-    def _startJob(self, worker, index=None):
+    def isIndexLocked(self, index):
+        """Check that a running job changes the resource.
+
+        Jobs that delete a resource lock its whole subtree, other jobs
+        lock just their target. Resources of a locked index must not be
+        changed by other requests.
+        """
+        item = self.item(index)
+        if item in self.__item_lock_counts:
+            return True
+        item = item.parent()
+        while item is not None:
+            if item in self.__subtree_lock_counts:
+                return True
+            item = item.parent()
+        return False
+
+    def jobScheduler(self):
+        return self.__job_scheduler
+
+    def jobStatusAggregator(self):
+        return self.__job_status_aggregator
+
+    def shutdown(self):
+        self.saveTreeCache()
+        if self.__tree_cache is not None:
+            self.__tree_cache.wait()
+        self.__job_status_aggregator.clear()
+        self.__job_scheduler.shutdown()
+
+    def cancelJob(self, job):
+        if job not in self.jobs:
+            return
+        job.cancel()
+        self.__job_status_aggregator.jobCancelling(job)
+        if self.__job_scheduler.unschedule(job):
+            job.abort()
+
+    def cancelJobs(self, job_ids=None):
+        """Cancel jobs with the given ids or all jobs.
+
+        Queued jobs are dropped, running jobs are asked to stop.
+        """
+        for job in list(self.jobs):
+            if job_ids is None or job.getJobId() in job_ids:
+                self.cancelJob(job)
+
+    def _startJob(self, worker, index=None, priority=NGWJobScheduler.PriorityNormal, lock_subtree=False):
         job = NGWResourcesModelJob(self, worker)
         job.started.connect(self.__jobStartedProcess)
         job.statusChanged.connect(self.__jobStatusChangedProcess)
         job.finished.connect(self.__jobFinishedProcess)
+        job.batchReceived.connect(self.__jobBatchReceivedProcess)
+        job.progressChanged.connect(self.__jobProgressChangedProcess)
         job.errorOccurred.connect(self.__jobErrorOccurredProcess)
         job.warningOccurred.connect(self.__jobWarningOccurredProcess)
 
         self.jobs.append(job)
 
         if index is not None:
-            self._lockIndexByJob(index, job)
+            self._lockIndexByJob(index, job, lock_subtree)
 
-        job.start()
+        # Running workers can be cancelled only if they check the token
+        self.__job_status_aggregator.jobQueued(
+            job, getattr(worker, "supports_cancellation", False)
+        )
+        self.__job_scheduler.schedule(job, priority)
 
         return job
 
     def __jobStartedProcess(self):
         job = self.sender()
+        self.__job_status_aggregator.jobStarted(job)
         self.jobStarted.emit(job.getJobId())
 
     def __jobStatusChangedProcess(self, new_status):
+        # Statuses are delivered as jobStatusChanged at a limited rate
         job = self.sender()
-        self.jobStatusChanged.emit(job.getJobId(), new_status)
+        self.__job_status_aggregator.jobStatusChanged(job, new_status)
+
+    def __jobProgressChangedProcess(self, done, total):
+        job = self.sender()
+        self.__job_status_aggregator.jobProgressChanged(job, done, total)
 
     def __jobFinishedProcess(self):
         job = self.sender()
 
-        self.processJobResult(job)
-        self._unlockIndexesByJob(job)
+        self.__job_status_aggregator.jobFinished(job)
+        if job in self.__dropped_jobs:
+            self.__dropped_jobs.discard(job)
+            self._unlockIndexesByJob(job)
+        else:
+            self.processJobResult(job)
+            self._unlockIndexesByJob(job)
+            self.jobFinished.emit(job.getJobId())
 
-        self.jobFinished.emit(job.getJobId())
         job.deleteLater()
         self.jobs.remove(job)
 
+    def __jobBatchReceivedProcess(self, batch):
+        job = self.sender()
+        if job in self.__dropped_jobs:
+            return
+        self.processJobBatch(job, batch)
+
     def __jobErrorOccurredProcess(self, error):
         job = self.sender()
+        if job in self.__dropped_jobs:
+            log("Error of a job of the previous connection: {}".format(error))
+            return
+        if job in self.__prefetch_depths:
+            # Group is listed again when the user expands it
+            log("Prefetch of group children failed: {}".format(error))
+            return
+        if job is self.__version_probe_job:
+            log("Failed to get NGW version: {}".format(error))
+            return
         self.errorOccurred.emit(job.getJobId(), error)
 
     def __jobWarningOccurredProcess(self, error):
         job = self.sender()
+        if job in self.__dropped_jobs:
+            return
         self.warningOccurred.emit(job.getJobId(), error)
 
     def addNGWResourceToTree(self, parent, ngw_resource):
         parent_item = self.item(parent)
 
         new_item = QNGWResourceItem(ngw_resource)
-        i = -1
-        for i in range(parent_item.childCount()):
-            item = parent_item.child(i)
-            if new_item.more_priority(item):
-                break
-        else:
-            i += 1
+        i = self._insertionRow(parent_item.children(), new_item)
 
         self.beginInsertRows(parent, i, i)
         parent_item.insertChild(i, new_item)
+        self._registerItem(new_item)
         self.endInsertRows()
 
         return self.index(i, 0, parent)
 
-    def _lockIndexByJob(self, index, job):
-        if job not in self.__indexes_locked_by_jobs:
-            self.__indexes_locked_by_jobs[job] = []
-        self.__indexes_locked_by_jobs[job].append(index)
+    def addNGWResourcesToTree(self, parent, ngw_resources):
+        """Insert a batch of resources keeping children sorted.
+
+        The batch is sorted once and split into runs of items that go to
+        the same position among the current children, every run is
+        inserted with a single rows insert notification.
+        """
+        new_items = sorted(
+            (QNGWResourceItem(ngw_resource) for ngw_resource in ngw_resources),
+            key=QNGWResourceItem.sort_key
+        )
+        self._insertItems(parent, new_items)
+
+    def addNGWResourcesToTreePaged(self, parent, ngw_resources):
+        """Insert the first page of the resources, keep others for fetchMore.
+
+        The page size is taken from the plugin settings, zero disables
+        paging. Items are built and inserted in chunks within
+        POPULATION_TIME_BUDGET per event loop turn, so large groups are
+        populated progressively without freezing the GUI.
+        """
+        parent_item = self.item(parent)
+
+        items = []
+        resources = ngw_resources
+        population = self.__populations.get(parent_item)
+        if population is not None:
+            # Group is listed again while populating, resources that are
+            # not inserted yet are kept unless they are listed again
+            new_ids = set(ngw_resource.common.id for ngw_resource in ngw_resources)
+            if population["inserted"] is None:
+                left_items = population["items"]
+                left_resources = population["resources"][population["built"]:]
+            else:
+                left_items = population["items"][population["inserted"]:]
+                left_resources = []
+            items = [item for item in left_items if item.ngw_resource_id() not in new_ids]
+            resources = [
+                ngw_resource for ngw_resource in left_resources
+                if ngw_resource.common.id not in new_ids
+            ]
+            resources.extend(ngw_resources)
+
+        self.__populations[parent_item] = {
+            "resources": resources,
+            "built": 0,
+            "items": items,
+            "inserted": None,
+        }
+        self._populate(parent_item, time.monotonic() + self.POPULATION_TIME_BUDGET)
+        if parent_item in self.__populations:
+            self._emitItemChanged(parent_item)
+            self.__population_timer.start()
+
+    def __continuePopulations(self):
+        deadline = time.monotonic() + self.POPULATION_TIME_BUDGET
+        for parent_item in list(self.__populations):
+            if time.monotonic() >= deadline:
+                break
+            self._populate(parent_item, deadline)
+            self._emitItemChanged(parent_item)
+
+        if len(self.__populations) == 0:
+            self.__population_timer.stop()
+
+    def _populate(self, parent_item, deadline):
+        population = self.__populations[parent_item]
+        resources = population["resources"]
+        items = population["items"]
+        chunk_size = self.POPULATION_CHUNK_SIZE
+
+        while population["built"] < len(resources):
+            if time.monotonic() >= deadline:
+                return
+            built = population["built"]
+            items.extend(
+                QNGWResourceItem(ngw_resource)
+                for ngw_resource in resources[built:built + chunk_size]
+            )
+            population["built"] = min(built + chunk_size, len(resources))
+
+        if population["inserted"] is None:
+            # Pages left by an earlier listing are merged, new items win
+            new_ids = set(item.ngw_resource_id() for item in items)
+            items.extend(
+                item for item in self.__pending_children.pop(parent_item, [])
+                if item.ngw_resource_id() not in new_ids
+            )
+            items.sort(key=QNGWResourceItem.sort_key)
+            page_size = PluginSettings.fetch_page_size()
+            if page_size > 0 and len(items) > page_size:
+                self.__pending_children[parent_item] = items[:page_size - 1:-1]
+                del items[page_size:]
+            population["inserted"] = 0
+
+        parent = self._indexFromItem(parent_item)
+        while population["inserted"] < len(items):
+            if time.monotonic() >= deadline:
+                return
+            inserted = population["inserted"]
+            # Resource could be added by another job in the meantime
+            chunk = [
+                item for item in items[inserted:inserted + chunk_size]
+                if item.ngw_resource_id() not in self.__items_by_ngw_resource_id
+            ]
+            self._insertItems(parent, chunk)
+            population["inserted"] = min(inserted + chunk_size, len(items))
+
+        del self.__populations[parent_item]
+
+        prefetch_depth = self.__deferred_prefetches.pop(parent_item, None)
+        if prefetch_depth is not None:
+            self._prefetchSubgroups(parent_item, prefetch_depth)
+
+    def _addPendingChildrenPage(self, parent):
+        parent_item = self.item(parent)
+        pending_items = self.__pending_children[parent_item]
+
+        page_items = []
+        page_size = max(PluginSettings.fetch_page_size(), 1)
+        while len(pending_items) > 0 and len(page_items) < page_size:
+            item = pending_items.pop()
+            # Resource could be added by another job in the meantime
+            if item.ngw_resource_id() not in self.__items_by_ngw_resource_id:
+                page_items.append(item)
+
+        if len(pending_items) == 0:
+            del self.__pending_children[parent_item]
+
+        self._insertItems(parent, page_items)
+        return len(page_items)
+
+    def _insertItems(self, parent, new_items):
+        """Insert sorted items, each contiguous run is inserted at once."""
+        parent_item = self.item(parent)
+
+        runs = []
+        for new_item in new_items:
+            row = self._insertionRow(parent_item.children(), new_item)
+            if len(runs) > 0 and runs[-1][0] == row:
+                runs[-1][1].append(new_item)
+            else:
+                runs.append((row, [new_item]))
+
+        # Rows are calculated for the children before insertion, so every
+        # inserted run shifts the following ones
+        inserted_count = 0
+        for row, items in runs:
+            first = row + inserted_count
+            self.beginInsertRows(parent, first, first + len(items) - 1)
+            parent_item.insertChildren(first, items)
+            for item in items:
+                self._registerItem(item)
+            self.endInsertRows()
+            inserted_count += len(items)
+
+    def _insertionRow(self, children, new_item):
+        sort_key = new_item.sort_key()
+        low = 0
+        high = len(children)
+        while low < high:
+            middle = (low + high) // 2
+            if sort_key < children[middle].sort_key():
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+    def _removeChildRows(self, parent, rows):
+        """Remove rows of the parent, contiguous rows are removed at once."""
+        parent_item = self.item(parent)
+
+        runs = []
+        for row in sorted(set(rows), reverse=True):
+            if len(runs) > 0 and runs[-1][0] == row + 1:
+                runs[-1][0] = row
+            else:
+                runs.append([row, row])
+
+        for first, last in runs:
+            self.beginRemoveRows(parent, first, last)
+            for child_item in parent_item.takeChildren(first, last - first + 1):
+                self._unregisterItem(child_item)
+            self.endRemoveRows()
+
+    def _updateItemsResources(self, parent, ngw_resources):
+        """Replace resources of existing children of the parent in place.
+
+        Loaded children of the updated items are kept. Items whose sort
+        position changed are moved, the others are reported with a single
+        dataChanged for the affected rows.
+        """
+        parent_item = self.item(parent)
+
+        changed_items = []
+        for ngw_resource in ngw_resources:
+            item = self.__items_by_ngw_resource_id[ngw_resource.common.id]
+            item.setNGWResource(ngw_resource)
+            if self._isItemInSortedPosition(parent_item, item.row()):
+                changed_items.append(item)
+            else:
+                self._moveItemToSortedPosition(parent, item)
+
+        if len(changed_items) > 0:
+            changed_rows = [item.row() for item in changed_items]
+            self.dataChanged.emit(
+                self.index(min(changed_rows), 0, parent),
+                self.index(max(changed_rows), 0, parent),
+            )
+
+    def _isItemInSortedPosition(self, parent_item, row):
+        children = parent_item.children()
+        sort_key = children[row].sort_key()
+        if row > 0 and children[row - 1].sort_key() > sort_key:
+            return False
+        if row + 1 < len(children) and sort_key > children[row + 1].sort_key():
+            return False
+        return True
+
+    def _moveItemToSortedPosition(self, parent, item):
+        parent_item = self.item(parent)
+        row = item.row()
+
+        other_children = [child for child in parent_item.children() if child is not item]
+        new_row = self._insertionRow(other_children, item)
+        destination_row = new_row + 1 if new_row >= row else new_row
+
+        if not self.beginMoveRows(parent, row, row, parent, destination_row):
+            self.dataChanged.emit(self.index(row, 0, parent), self.index(row, 0, parent))
+            return
+        parent_item.takeChild(row)
+        parent_item.insertChild(new_row, item)
+        self.endMoveRows()
+
+    def _registerItem(self, item):
+        self.__items_by_ngw_resource_id[item.ngw_resource_id()] = item
+
+    def _unregisterItem(self, item):
+        # Children are owned by the removed item, so the whole subtree goes away
+        stack = [item]
+        while stack:
+            current_item = stack.pop()
+            self.__pending_children.pop(current_item, None)
+            self.__populations.pop(current_item, None)
+            self.__deferred_prefetches.pop(current_item, None)
+            self.__stale_items.discard(current_item)
+            self.__items_locked_by_job_errors.pop(current_item, None)
+            if isinstance(current_item, QNGWResourceItem):
+                ngw_resource_id = current_item.ngw_resource_id()
+                if self.__items_by_ngw_resource_id.get(ngw_resource_id) is current_item:
+                    del self.__items_by_ngw_resource_id[ngw_resource_id]
+            stack.extend(current_item.children())
+
+    def _isItemInModel(self, item):
+        if item is self.root_item:
+            return True
+        if not isinstance(item, QNGWResourceItem):
+            return False
+        return self.__items_by_ngw_resource_id.get(item.ngw_resource_id()) is item
+
+    def _indexFromItem(self, item):
+        if item is None or item is self.root_item:
+            return QModelIndex()
+        return self.createIndex(item.row(), 0, item)
 
+    def _lockIndexByJob(self, index, job, lock_subtree=False):
         item = self.item(index)
-        #self.beginInsertRows(index, item.childCount(), item.childCount())
-        item.lock()
-        #self.endInsertRows()
+        self.__items_locked_by_jobs.setdefault(job, []).append((item, lock_subtree))
 
-        QCoreApplication.processEvents()
+        lock_count = self.__item_lock_counts.get(item, 0)
+        self.__item_lock_counts[item] = lock_count + 1
+        if lock_count == 0:
+            item.lock()
+            self._emitItemChanged(item)
+        if lock_subtree:
+            self.__subtree_lock_counts[item] = self.__subtree_lock_counts.get(item, 0) + 1
 
         self.indexesLocked.emit()
 
     def _unlockIndexesByJob(self, job):
-        indexes = self.__indexes_locked_by_jobs.get(job, [])
-        self.__indexes_locked_by_jobs[job] = []
-
-        for index in indexes:
-            item = self.item(index)
-
-            #self.beginRemoveRows(index, item.childCount(), item.childCount())
-            item.unlock()
-            #self.endRemoveRows()
+        items = self.__items_locked_by_jobs.pop(job, None)
+        if items is None:
+            return
 
-            if job.error() is not None:
-                self.__indexes_locked_by_job_errors[index] = job.error()
+        for item, lock_subtree in items:
+            if lock_subtree:
+                subtree_lock_count = self.__subtree_lock_counts.pop(item) - 1
+                if subtree_lock_count > 0:
+                    self.__subtree_lock_counts[item] = subtree_lock_count
 
-        QCoreApplication.processEvents()
+            lock_count = self.__item_lock_counts.pop(item) - 1
+            if lock_count > 0:
+                self.__item_lock_counts[item] = lock_count
+            else:
+                item.unlock()
+                self._emitItemChanged(item)
 
         self.indexesUnlocked.emit()
 
     def _isIndexLockedByJob(self, index):
-        for indexes in self.__indexes_locked_by_jobs.values():
-            if index in indexes:
-                return True
-        return False
+        return self.item(index) in self.__item_lock_counts
 
     def _isIndexLockedByJobError(self, index):
-        return index in self.__indexes_locked_by_job_errors
+        return self.item(index) in self.__items_locked_by_job_errors
 
-    def getIndexByNGWResourceId(self, ngw_resource_id, parent=None):
-        if parent is None:
-            parent = self.index(0, 0, QModelIndex())
-        item = parent.internalPointer()
-
-        if isinstance(item, QNGWResourceItem):
-            if item.ngw_resource_id() == ngw_resource_id:
-                return parent
+    def _emitItemChanged(self, item):
+        if item is self.root_item or not self._isItemInModel(item):
+            return
+        index = self._indexFromItem(item)
+        self.dataChanged.emit(index, index)
 
-        for i in range(item.childCount()):
-            index = self.getIndexByNGWResourceId(
-                ngw_resource_id,
-                self.index(i, 0, parent)
-            )
-
-            if index is not None:
-                return index
+    def getIndexByNGWResourceId(self, ngw_resource_id):
+        item = self.__items_by_ngw_resource_id.get(ngw_resource_id)
+        if item is None:
+            return None
+        return self._indexFromItem(item)
 
     def processJobResult(self, job):
+        if job is self.__version_probe_job:
+            self.__version_probe_job = None
+            self._processVersionProbeResult(job)
+            return
+
+        listed_parent_item = self.__children_listing_jobs.pop(job, None)
+        prefetch_depth = self.__prefetch_depths.pop(job, None)
+        if listed_parent_item is not None:
+            if job.error() is not None and (listed_parent_item, False) in self.__items_locked_by_jobs.get(job, []):
+                # Failed listing requested by the user is not repeated on fetchMore
+                self.__items_locked_by_job_errors[listed_parent_item] = job.error()
+            if self.__children_listing_jobs_by_parent.get(listed_parent_item) is job:
+                del self.__children_listing_jobs_by_parent[listed_parent_item]
+            if job.isCancelled():
+                return  # listing may be incomplete
+        subtree_item = self.__subtree_loading_jobs.pop(job, None)
+        streamed_ids = self.__streamed_resource_ids.pop(job, set())
         job_result = job.getResult()
 
         if job_result is None:
             # TODO Exception
             return
 
-        indexes = {}
-        for ngw_resource in job_result.added_resources:
+        model_response = job.model_response
+        is_listing = listed_parent_item is not None
+
+        if subtree_item is not None:
+            self._processSearchByParentSupport(job.getWorker())
+            # Whole subtree is inserted, so hidden pages must not hide parents
+            self._addAllPendingChildren(job.getWorker().listed_resource_ids)
+
+        relisted_resources = self._mergeAddedResources(
+            job_result.added_resources, job_result.main_resource_id, model_response, is_listing
+        )
+        if job_result.main_resource_id in streamed_ids and model_response is not None:
+            index = self.getIndexByNGWResourceId(job_result.main_resource_id)
+            if index is not None:
+                model_response.done.emit(index)
+        self._mergeEditedResources(job_result.edited_resources, model_response)
+        if is_listing:
+            # Children that are already in the tree are refreshed in place,
+            # children that are not listed anymore are removed
+            self._mergeEditedResources(relisted_resources, None)
+            self._removeUnlistedChildren(listed_parent_item, job_result.added_resources)
+        if subtree_item is not None:
+            self._mergeEditedResources(relisted_resources, None)
+            self._mergeListedSubtree(
+                job.getWorker().listed_resource_ids, job_result.added_resources
+            )
+            if model_response is not None and self._isItemInModel(subtree_item):
+                model_response.done.emit(self._indexFromItem(subtree_item))
+        self._mergeDeletedResources(job_result.deleted_resources, model_response)
+
+        if is_listing and job.error() is None:
+            if prefetch_depth is None:
+                prefetch_depth = PluginSettings.prefetch_depth()
+            if listed_parent_item in self.__populations:
+                # Background listings would slow down the visible insert
+                self.__deferred_prefetches[listed_parent_item] = max(
+                    prefetch_depth, self.__deferred_prefetches.get(listed_parent_item, 0)
+                )
+            else:
+                self._prefetchSubgroups(listed_parent_item, prefetch_depth)
+
+        self.__cache_save_timer.start()
+
+    def processJobBatch(self, job, batch):
+        """Merge a part of the job result while the job is running.
+
+        Batches only add, update and delete the resources they carry.
+        Unlisted children are removed and responses are notified when the
+        whole result is processed.
+        """
+        if job.isCancelled() and job in self.__children_listing_jobs:
+            return
+
+        streamed_ids = self.__streamed_resource_ids.setdefault(job, set())
+        streamed_ids.update(
+            ngw_resource.common.id for ngw_resource in batch.added_resources
+            if ngw_resource.common.id not in self.__items_by_ngw_resource_id
+        )
+
+        self._mergeAddedResources(batch.added_resources, None, None, False)
+        self._mergeEditedResources(batch.edited_resources, None)
+        self._mergeDeletedResources(batch.deleted_resources, None)
+
+    def _mergeAddedResources(self, ngw_resources, main_resource_id, model_response, is_listing):
+        """Insert new resources grouped by parent.
+
+        Return resources that are already in the tree.
+        """
+        added_resources = {}
+        added_ids = set()
+        existing_resources = []
+        for ngw_resource in ngw_resources:
+            ngw_resource_id = ngw_resource.common.id
+            if ngw_resource_id in added_ids:
+                continue
+            if ngw_resource_id in self.__items_by_ngw_resource_id:
+                existing_resources.append(ngw_resource)
+                continue
+            added_ids.add(ngw_resource_id)
+
             if ngw_resource.common.parent is None:
-                index = QModelIndex()
-                new_index = self.addNGWResourceToTree(index, ngw_resource)
+                parent_id = None
             else:
                 parent_id = ngw_resource.common.parent.id
-                if parent_id not in indexes:
-                    indexes[parent_id] = self.getIndexByNGWResourceId(parent_id)
-                index = indexes[parent_id]
-
-                item = index.internalPointer()
-                current_ids = [item.child(i).ngw_resource_id() for i in range(item.childCount()) if isinstance(item.child(i), QNGWResourceItem)]
-                if ngw_resource.common.id not in current_ids:
-                    new_index = self.addNGWResourceToTree(index, ngw_resource)
+            added_resources.setdefault(parent_id, []).append(ngw_resource)
+
+        if is_listing:
+            add_resources = self.addNGWResourcesToTreePaged
+        else:
+            add_resources = self.addNGWResourcesToTree
+
+        # Parents are looked up right before insertion: a parent may be
+        # added by the same job
+        while len(added_resources) > 0:
+            deferred_resources = {}
+            for parent_id, parent_resources in added_resources.items():
+                if parent_id is None:
+                    index = QModelIndex()
                 else:
-                    continue
+                    index = self.getIndexByNGWResourceId(parent_id)
+                    if index is None:
+                        deferred_resources[parent_id] = parent_resources
+                        continue
+                add_resources(index, parent_resources)
+
+            if len(deferred_resources) == len(added_resources):
+                break  # parents are not loaded into the tree
+            added_resources = deferred_resources
 
-            if job_result.main_resource_id == ngw_resource.common.id:
-                if job.model_response is not None:
-                    job.model_response.done.emit(new_index)
+        if main_resource_id in added_ids and model_response is not None:
+            model_response.done.emit(self.getIndexByNGWResourceId(main_resource_id))
 
-        for ngw_resource in job_result.edited_resources:
+        return existing_resources
+
+    def _mergeEditedResources(self, ngw_resources, model_response):
+        edited_resources = {}
+        for ngw_resource in ngw_resources:
             if ngw_resource.common.parent is None:
-                self.cleanModel() # remove root item
-                index = QModelIndex()
-            else:
-                index = self.getIndexByNGWResourceId(
-                    ngw_resource.common.parent.id,
-                )
-                item = index.internalPointer()
-
-                for i in range(item.childCount()):
-                    if item.child(i).ngw_resource_id() == ngw_resource.common.id:
-                        self.beginRemoveRows(index, i, i)
-                        item.removeChild(item.child(i))
-                        self.endRemoveRows()
-                        break
+                if ngw_resource.common.id in self.__items_by_ngw_resource_id:
+                    self._updateItemsResources(QModelIndex(), [ngw_resource])
+                    new_index = self.getIndexByNGWResourceId(ngw_resource.common.id)
                 else:
-                    # TODO exception: not find deleted resource in corrent tree
-                    return
+                    self.__cleanModel() # remove root item, jobs are kept
+                    new_index = self.addNGWResourceToTree(QModelIndex(), ngw_resource)
+                if model_response is not None:
+                    model_response.done.emit(new_index)
+                continue
+            edited_resources.setdefault(ngw_resource.common.parent.id, []).append(ngw_resource)
+
+        for parent_id, parent_resources in edited_resources.items():
+            index = self.getIndexByNGWResourceId(parent_id)
+            if index is None:
+                # TODO exception: not find edited resource parent in corrent tree
+                continue
+            parent_item = self.item(index)
+
+            replaced_resources = []
+            moved_resources = []
+            for ngw_resource in parent_resources:
+                item = self.__items_by_ngw_resource_id.get(ngw_resource.common.id)
+                if item is not None and item.parent() is parent_item:
+                    replaced_resources.append(ngw_resource)
+                else:
+                    moved_resources.append(ngw_resource)
+
+            # Resources moved from another group are removed from the old one
+            for ngw_resource in moved_resources:
+                item = self.__items_by_ngw_resource_id.get(ngw_resource.common.id)
+                if item is not None and item.parent() is not None:
+                    self._removeChildRows(self._indexFromItem(item.parent()), [item.row()])
+
+            index = self.getIndexByNGWResourceId(parent_id)
+            self._updateItemsResources(index, replaced_resources)
+            self.addNGWResourcesToTree(index, moved_resources)
+
+            if model_response is not None:
+                for ngw_resource in parent_resources:
+                    model_response.done.emit(
+                        self.getIndexByNGWResourceId(ngw_resource.common.id)
+                    )
+
+    def _mergeDeletedResources(self, ngw_resources, model_response):
+        deleted_ids = {}
+        for ngw_resource in ngw_resources:
+            if ngw_resource.common.parent is not None:
+                deleted_ids.setdefault(ngw_resource.common.parent.id, set()).add(ngw_resource.common.id)
+        for parent_id, ngw_resource_ids in deleted_ids.items():
+            parent_item = self.__items_by_ngw_resource_id.get(parent_id)
+            if parent_item is not None:
+                self._dropNotInsertedChildren(parent_item, ngw_resource_ids)
+
+        deleted_rows = {}
+        for ngw_resource in ngw_resources:
+            item = self.__items_by_ngw_resource_id.get(ngw_resource.common.id)
+            if item is None or item.parent() is None:
+                # TODO exception: not find deleted resource in corrent tree
+                continue
+            deleted_rows.setdefault(item.parent(), []).append(item.row())
+
+        for parent_item, rows in deleted_rows.items():
+            if not self._isItemInModel(parent_item):
+                continue  # removed together with its parent
+            index = self._indexFromItem(parent_item)
+            self._removeChildRows(index, rows)
+
+            if isinstance(parent_item, QNGWResourceItem):
+                ngw_resource = parent_item.data(QNGWResourceItem.NGWResourceRole)
+                ngw_resource.update()
+
+            if model_response is not None:
+                model_response.done.emit(index)
+
+    def _dropNotInsertedChildren(self, parent_item, ngw_resource_ids):
+        """Forget pending and populating children with the given ids."""
+        pending_items = self.__pending_children.get(parent_item)
+        if pending_items is not None:
+            pending_items[:] = [
+                item for item in pending_items if item.ngw_resource_id() not in ngw_resource_ids
+            ]
+            if len(pending_items) == 0:
+                del self.__pending_children[parent_item]
+
+        population = self.__populations.get(parent_item)
+        if population is not None:
+            built = population["built"]
+            population["resources"] = population["resources"][:built] + [
+                ngw_resource for ngw_resource in population["resources"][built:]
+                if ngw_resource.common.id not in ngw_resource_ids
+            ]
+            items = population["items"]
+            inserted = population["inserted"] or 0
+            items[inserted:] = [
+                item for item in items[inserted:] if item.ngw_resource_id() not in ngw_resource_ids
+            ]
+
+    def _removeUnlistedChildren(self, parent_item, listed_resources):
+        if not self._isItemInModel(parent_item):
+            return
+
+        listed_ids = set(ngw_resource.common.id for ngw_resource in listed_resources)
+
+        pending_items = self.__pending_children.get(parent_item)
+        if pending_items is not None:
+            pending_items[:] = [
+                item for item in pending_items if item.ngw_resource_id() in listed_ids
+            ]
+            if len(pending_items) == 0:
+                del self.__pending_children[parent_item]
+
+        rows = [
+            row for row, item in enumerate(parent_item.children())
+            if item.ngw_resource_id() not in listed_ids
+        ]
+        if len(rows) > 0:
+            self._removeChildRows(self._indexFromItem(parent_item), rows)
+
+    def _addAllPendingChildren(self, ngw_resource_ids):
+        for ngw_resource_id in ngw_resource_ids:
+            item = self.__items_by_ngw_resource_id.get(ngw_resource_id)
+            while item in self.__pending_children:
+                self._addPendingChildrenPage(self._indexFromItem(item))
+
+    def _mergeListedSubtree(self, listed_ids, ngw_resources):
+        """Drop children missing from the listed groups of a loaded subtree."""
+        listed_resources = {ngw_resource_id: [] for ngw_resource_id in listed_ids}
+        for ngw_resource in ngw_resources:
+            parent_id = ngw_resource.common.parent.id
+            if parent_id in listed_resources:
+                listed_resources[parent_id].append(ngw_resource)
+
+        for ngw_resource_id in listed_ids:
+            item = self.__items_by_ngw_resource_id.get(ngw_resource_id)
+            if item is None:
+                continue
+            self.__stale_items.discard(item)
+            self._removeUnlistedChildren(item, listed_resources[ngw_resource_id])
+
+    def _startSubtreeLoadingJob(self, index):
+        item = self.item(index)
+        ngw_resource = item.data(QNGWResourceItem.NGWResourceRole)
+        search_supported, checked_at = self._cachedSearchByParent()
+        if time.time() - checked_at >= PluginSettings.ngw_version_cache_ttl():
+            search_supported = None
+        job = self._startJob(
+            NGWSubtreeLoader(ngw_resource, search_supported=search_supported),
+            index,
+            NGWJobScheduler.PriorityInteractive,
+        )
+        self.__subtree_loading_jobs[job] = item
+        return job
+
+    def _startChildrenListingJob(self, parent, lock=True, priority=NGWJobScheduler.PriorityInteractive):
+        parent_item = self.item(parent)
+
+        # Identical listing in flight is shared instead of starting another one
+        job = self.__children_listing_jobs_by_parent.get(parent_item)
+        if job is not None and not job.isCancelled():
+            self.__job_scheduler.promote(job, priority)
+            if lock and not self._isIndexLockedByJob(parent):
+                self._lockIndexByJob(parent, job)
+            return job
+
+        if parent_item is self.root_item:
+            worker = NGWRootResourcesLoader(self._ngw_connection)
+        else:
+            ngw_resource = parent_item.data(QNGWResourceItem.NGWResourceRole)
+            worker = NGWResourceUpdater(ngw_resource)
+        # Results of cancelled listings are ignored, so they stop at once
+        worker.supports_cancellation = True
 
-            new_index = self.addNGWResourceToTree(index, ngw_resource)
+        job = self._startJob(worker, parent if lock else None, priority)
+        self.__children_listing_jobs[job] = parent_item
+        self.__children_listing_jobs_by_parent[parent_item] = job
+        return job
+
+    def _prefetchSubgroups(self, parent_item, depth):
+        """List children of not loaded subgroups in background.
+
+        Prefetched groups prefetch their own subgroups until the depth is
+        exhausted. The number of prefetch listings in flight is limited by
+        the prefetch budget.
+        """
+        if depth <= 0 or not PluginSettings.prefetch_enabled():
+            return
+        if not self._isItemInModel(parent_item):
+            return
 
-            if job.model_response is not None:
-                job.model_response.done.emit(new_index)
+        budget = PluginSettings.prefetch_budget() - len(self.__prefetch_depths)
+        for item in parent_item.children():
+            if budget <= 0:
+                break
+            if item.childCount() > 0 or item in self.__children_listing_jobs_by_parent:
+                continue
+            ngw_resource = item.data(QNGWResourceItem.NGWResourceRole)
+            if not ngw_resource.common.children:
+                continue
 
-        for ngw_resource in job_result.deleted_resources:
-            index = self.getIndexByNGWResourceId(
-                ngw_resource.common.parent.id,
+            job = self._startChildrenListingJob(
+                self._indexFromItem(item), lock=False, priority=NGWJobScheduler.PriorityBackground
             )
-            item = index.internalPointer()
-
-            for i in range(item.childCount()):
-                if item.child(i).ngw_resource_id() == ngw_resource.common.id:
-                    self.beginRemoveRows(index, i, i)
-                    item.removeChild(item.child(i))
-                    self.endRemoveRows()
-                    break
+            self.__prefetch_depths[job] = depth - 1
+            budget -= 1
+
+    def setIndexExpanded(self, index, expanded):
+        item = self.item(index)
+        if not isinstance(item, QNGWResourceItem):
+            return
+        if expanded:
+            self.__expanded_ids.add(item.ngw_resource_id())
+        else:
+            self.__expanded_ids.discard(item.ngw_resource_id())
+        self.__cache_save_timer.start()
+
+    def expandedIndexes(self):
+        indexes = []
+        for ngw_resource_id in self.__expanded_ids:
+            index = self.getIndexByNGWResourceId(ngw_resource_id)
+            if index is not None:
+                indexes.append(index)
+        return indexes
+
+    def refreshTree(self):
+        """Reload visible groups and merge the differences into the tree.
+
+        The root and the expanded groups that are visible are reloaded.
+        Other loaded groups are marked as stale and are reloaded on their
+        next fetchMore. Return False if the tree is not loaded yet.
+        """
+        if self._ngw_connection is None or self.root_item.childCount() == 0:
+            return False
+
+        self.__items_locked_by_job_errors = {}
+
+        visible_expanded_items = []
+        stack = [(item, True) for item in self.root_item.children()]
+        while stack:
+            item, is_visible = stack.pop()
+            if item.childCount() == 0:
+                continue
+            if is_visible and item.ngw_resource_id() in self.__expanded_ids:
+                visible_expanded_items.append(item)
             else:
-                # TODO exception: not find deleted resource in corrent tree
-                return
+                self.__stale_items.add(item)
+                is_visible = False
+            stack.extend((child, is_visible) for child in item.children())
 
-            ngw_resource = item.data(QNGWResourceItem.NGWResourceRole)
-            ngw_resource.update()
+        self._startChildrenListingJob(
+            QModelIndex(), lock=False, priority=NGWJobScheduler.PriorityNormal
+        )
+        for item in visible_expanded_items:
+            self.__stale_items.discard(item)
+            self._startChildrenListingJob(
+                self._indexFromItem(item), lock=False, priority=NGWJobScheduler.PriorityNormal
+            )
+
+        return True
+
+    def _restoreFromCache(self):
+        """Build the tree from the cache without notifications.
 
-            if job.model_response is not None:
-                job.model_response.done.emit(index)
+        Must be called during the model reset. Restored groups are marked
+        as stale and are reloaded on the next fetchMore.
+        """
+        if self.__tree_cache is None:
+            return
+
+        rows = self.__tree_cache.load()
+        if len(rows) == 0:
+            return
 
-    def _get_ngw_version(self):
+        resource_factory = NGWResourceFactory(self._ngw_connection)
+        items = {}
+        children = {}
         try:
-            self.ngw_version = self._ngw_connection.get_version()
-        except:
-            self.ngw_version = None
+            for ngw_resource_id, parent_id, children_count, expanded, resource_json in rows:
+                if parent_id is None:
+                    parent_item = self.root_item
+                else:
+                    parent_item = items.get(parent_id)
+                    if parent_item is None:
+                        continue
+
+                ngw_resource = resource_factory.get_resource_by_json(resource_json)
+                ngw_resource.children_count = children_count
+
+                item = QNGWResourceItem(ngw_resource)
+                items[ngw_resource_id] = item
+                children.setdefault(parent_item, []).append(item)
+                if expanded:
+                    self.__expanded_ids.add(ngw_resource_id)
+        except Exception as error:
+            log("Failed to restore resource tree from cache: {}".format(error))
+            self.__expanded_ids = set()
+            return
+
+        for parent_item, child_items in children.items():
+            child_items.sort(key=QNGWResourceItem.sort_key)
+            parent_item.insertChildren(0, child_items)
+            if parent_item is not self.root_item:
+                self.__stale_items.add(parent_item)
+
+        for item in items.values():
+            self._registerItem(item)
+
+    def _revalidateRestoredTree(self):
+        """Reload the root and expanded groups in background."""
+        self._startChildrenListingJob(
+            QModelIndex(), lock=False, priority=NGWJobScheduler.PriorityNormal
+        )
+
+        for index in self.expandedIndexes():
+            item = self.item(index)
+            if item in self.__stale_items:
+                self.__stale_items.discard(item)
+                self._startChildrenListingJob(
+                    index, lock=False, priority=NGWJobScheduler.PriorityNormal
+                )
+
+    def saveTreeCache(self):
+        self.__cache_save_timer.stop()
+        if self.__tree_cache is None:
+            return
+
+        rows = []
+        stack = [(item, 0) for item in reversed(self.root_item.children())]
+        while stack:
+            item, depth = stack.pop()
+            ngw_resource = item.data(QNGWResourceItem.NGWResourceRole)
+            parent_item = item.parent()
+            if isinstance(parent_item, QNGWResourceItem):
+                parent_id = parent_item.ngw_resource_id()
+            else:
+                parent_id = None
+            rows.append((
+                ngw_resource.common.id,
+                parent_id,
+                ngw_resource.type_id,
+                ngw_resource.common.display_name,
+                ngw_resource.children_count,
+                ngw_resource.common.id in self.__expanded_ids,
+                # Copied, as resources are updated in place on the GUI thread
+                dict(vars(ngw_resource.common)),
+                depth,
+            ))
+            stack.extend((child, depth + 1) for child in reversed(item.children()))
+
+        self.__tree_cache.save(rows)
+
+    def _versionCacheKey(self):
+        if self.__ngw_connection_settings is None:
+            return None
+        connection_key = repr(NGWSession.connectionKey(self.__ngw_connection_settings))
+        return hashlib.sha1(connection_key.encode("utf-8")).hexdigest()
+
+    def _cachedNgwVersion(self):
+        cache_key = self._versionCacheKey()
+        if cache_key is None:
+            return None, 0.0
+        return PluginSettings.ngw_version_cache(cache_key)
+
+    def _probeNgwVersion(self):
+        """Request NGW version in background if the cached one is expired."""
+        _, checked_at = self._cachedNgwVersion()
+        if time.time() - checked_at < PluginSettings.ngw_version_cache_ttl():
+            return
+
+        self.__version_probe_job = self._startJob(
+            NGWVersionProbe(self._ngw_connection), priority=NGWJobScheduler.PriorityInteractive
+        )
+
+    def _cachedSearchByParent(self):
+        cache_key = self._versionCacheKey()
+        if cache_key is None:
+            return None, 0.0
+        return PluginSettings.search_by_parent_cache(cache_key)
+
+    def _processSearchByParentSupport(self, worker):
+        """Remember the support of search by parents found by a subtree loader."""
+        cache_key = self._versionCacheKey()
+        if cache_key is None or worker.search_supported is None:
+            return
+        PluginSettings.set_search_by_parent_cache(cache_key, worker.search_supported, time.time())
+
+    def _processVersionProbeResult(self, job):
+        if job.error() is not None:
+            return  # cached version is kept and probed again on reconnect
+
+        self.ngw_version = job.getWorker().version
+        cache_key = self._versionCacheKey()
+        if cache_key is not None:
+            PluginSettings.set_ngw_version_cache(cache_key, self.ngw_version, time.time())
 
 
 from ..ngw_api.qgis.ngw_resource_model_4qgis import (
@@ -495,16 +1430,32 @@ class QNGWResourceTreeModel(QNGWResourceTreeModelBase):
         ngw_resource_parent = parent_item.data(parent_item.NGWResourceRole)
 
         return self._startJob(
-            NGWGroupCreater(new_group_name, ngw_resource_parent)
+            NGWGroupCreater(new_group_name, ngw_resource_parent), parent_index
         )
 
+    @modelRequest()
+    def loadSubtree(self, index):
+        return self._startSubtreeLoadingJob(index)
+
     @modelRequest()
     def deleteResource(self, index):
         item = index.internalPointer()
         ngw_resource = item.data(QNGWResourceItem.NGWResourceRole)
 
         return self._startJob(
-            NGWResourceDelete(ngw_resource)
+            NGWResourceDelete(ngw_resource), index, lock_subtree=True
+        )
+
+    @modelRequest()
+    def copyResource(self, index, style_cache):
+        item = index.internalPointer()
+        ngw_resource = item.data(QNGWResourceItem.NGWResourceRole)
+        ngw_session = NGWSession.forConnection(self.connectionSettings())
+
+        return self._startJob(
+            NGWResourceCopier(ngw_resource, ngw_session, style_cache),
+            index,
+            priority=NGWJobScheduler.PriorityBulk,
         )
 
     @modelRequest()
@@ -521,7 +1472,7 @@ class QNGWResourceTreeModel(QNGWResourceTreeModelBase):
         ngw_resource = item.data(QNGWResourceItem.NGWResourceRole)
 
         return self._startJob(
-            NGWCreateWFSForVector(ngw_resource, ngw_parent_resource, ret_obj_num)
+            NGWCreateWFSForVector(ngw_resource, ngw_parent_resource, ret_obj_num), index
         )
 
     @modelRequest()
@@ -533,7 +1484,7 @@ class QNGWResourceTreeModel(QNGWResourceTreeModelBase):
         ngw_resource = item.data(QNGWResourceItem.NGWResourceRole)
 
         return self._startJob(
-            NGWCreateMapForStyle(ngw_resource)
+            NGWCreateMapForStyle(ngw_resource), index
         )
 
     @modelRequest()
@@ -542,7 +1493,7 @@ class QNGWResourceTreeModel(QNGWResourceTreeModelBase):
         ngw_resource = item.data(QNGWResourceItem.NGWResourceRole)
 
         return self._startJob(
-            NGWRenameResource(ngw_resource, new_name)
+            NGWRenameResource(ngw_resource, new_name), index
         )
 
 
@@ -557,6 +1508,8 @@ class QNGWResourceTreeModel(QNGWResourceTreeModelBase):
 
         return self._startJob(
             QGISResourcesImporter(qgs_map_layers, ngw_group, self.ngw_version),
+            parent_index,
+            priority=NGWJobScheduler.PriorityBulk,
         )
 
 
@@ -569,7 +1522,7 @@ class QNGWResourceTreeModel(QNGWResourceTreeModelBase):
         ngw_resource = item.data(QNGWResourceItem.NGWResourceRole)
 
         return self._startJob(
-            QGISStyleUpdater(qgs_map_layer, ngw_resource)
+            QGISStyleUpdater(qgs_map_layer, ngw_resource), index
         )
 
     @modelRequest()
@@ -581,7 +1534,7 @@ class QNGWResourceTreeModel(QNGWResourceTreeModelBase):
         ngw_resource = item.data(QNGWResourceItem.NGWResourceRole)
 
         return self._startJob(
-            QGISStyleAdder(qgs_map_layer, ngw_resource)
+            QGISStyleAdder(qgs_map_layer, ngw_resource), index
         )
 
 
@@ -597,6 +1550,8 @@ class QNGWResourceTreeModel(QNGWResourceTreeModelBase):
 
         return self._startJob(
             CurrentQGISProjectImporter(ngw_group_name, ngw_resource, iface, self.ngw_version),
+            index,
+            priority=NGWJobScheduler.PriorityBulk,
         )
 
     @modelRequest()
@@ -608,7 +1563,7 @@ class QNGWResourceTreeModel(QNGWResourceTreeModelBase):
         ngw_resource = item.data(QNGWResourceItem.NGWResourceRole)
 
         return self._startJob(
-            MapForLayerCreater(ngw_resource, ngw_style_id)
+            MapForLayerCreater(ngw_resource, ngw_style_id), index
         )
 
     @modelRequest()
@@ -625,7 +1580,7 @@ class QNGWResourceTreeModel(QNGWResourceTreeModelBase):
         ngw_resource = item.data(QNGWResourceItem.NGWResourceRole)
 
         return self._startJob(
-            NGWCreateWMSForVector(ngw_resource, ngw_parent_resource, ngw_resource_style_id),
+            NGWCreateWMSForVector(ngw_resource, ngw_parent_resource, ngw_resource_style_id), index
         )
 
     @modelRequest()
@@ -638,4 +1593,6 @@ class QNGWResourceTreeModel(QNGWResourceTreeModelBase):
 
         return self._startJob(
             NGWUpdateVectorLayer(ngw_vector_layer, qgs_vector_layer),
+            index,
+            priority=NGWJobScheduler.PriorityBulk,
         )
@@ -0,0 +1,313 @@
+import os
+
+from qgis.core import QgsRasterLayer, QgsVectorLayer
+from qgis.PyQt.QtCore import QDir, QTemporaryFile, QTimer, pyqtSignal
+
+from ..ngw_api.core import (
+    NGWQGISRasterStyle, NGWQGISVectorStyle, NGWRasterLayer, NGWVectorLayer,
+)
+from ..ngw_api.core.ngw_resource_factory import NGWResourceFactory
+from ..ngw_api.qgis.ngw_resource_model_4qgis import QGISResourceJob
+from ..ngw_api.qgis.resource_to_map import UnsupportedRasterTypeException
+from ..ngw_api.qt.qt_ngw_resource_model_job import (
+    NGWResourceModelJob, NGWResourceModelJobResult,
+)
+from ..ngw_api.qt.qt_ngw_resource_model_job_error import JobError, JobWarning
+from ..ngw_api.utils import log
+
+from ..ngw_download import NGWDownloader
+
+
+__all__ = ["NGWResourceCopier", "NGWSubtreeLoader", "NGWVersionProbe"]
+
+
+class NGWSubtreeLoader(NGWResourceModelJob):
+    """Loads all descendants of a group level by level.
+
+    Children of a whole level are requested with the resource search,
+    several parents per request. If the server can't search by parent,
+    children of every group are requested one by one. Resources of every
+    request are emitted as a batch, so the tree grows while loading.
+
+    Support of the search is passed in search_supported if it is known,
+    otherwise it is checked with a request that returns at most one
+    resource and is left in search_supported for the caller.
+    """
+
+    batchReceived = pyqtSignal(object)
+
+    supports_cancellation = True
+
+    SEARCH_URL = "/api/resource/search/"
+    PARENTS_PER_REQUEST = 50
+
+    def __init__(self, ngw_resource, max_depth=None, search_supported=None):
+        super().__init__()
+        self.ngw_resource = ngw_resource
+        self.max_depth = max_depth
+        self.search_supported = search_supported
+        # Groups whose children are completely loaded, parents go first
+        self.listed_resource_ids = []
+
+    def _do(self):
+        connection = self.ngw_resource._res_factory.connection
+        resource_factory = NGWResourceFactory(connection)
+        self.result.main_resource_id = self.ngw_resource.common.id
+
+        if self.search_supported is None:
+            self.search_supported = self.__probeSearch(connection)
+        use_search = self.search_supported is True
+        level = [self.ngw_resource]
+        depth = 0
+        loaded_count = 0
+        while len(level) > 0 and (self.max_depth is None or depth < self.max_depth):
+            next_level = []
+            for chunk_start in range(0, len(level), self.PARENTS_PER_REQUEST):
+                parents = level[chunk_start:chunk_start + self.PARENTS_PER_REQUEST]
+
+                children = None
+                if use_search:
+                    children = self.__searchChildren(connection, resource_factory, parents)
+                    use_search = children is not None
+                if children is None:
+                    children = []
+                    for parent in parents:
+                        if self.__isCancelled():
+                            return
+                        children.extend(parent.get_children())
+
+                if self.__isCancelled():
+                    return
+
+                batch = NGWResourceModelJobResult()
+                children_counts = {}
+                for child in children:
+                    parent_id = child.common.parent.id
+                    children_counts[parent_id] = children_counts.get(parent_id, 0) + 1
+                    self.result.putAddedResource(child)
+                    batch.putAddedResource(child)
+                    if child.common.children:
+                        next_level.append(child)
+                for parent in parents:
+                    if parent is not self.ngw_resource:
+                        parent.children_count = children_counts.get(parent.common.id, 0)
+                    self.listed_resource_ids.append(parent.common.id)
+                self.batchReceived.emit(batch)
+
+                loaded_count += len(children)
+                self.statusChanged.emit("Loaded {} resources".format(loaded_count))
+
+            level = next_level
+            depth += 1
+
+    def __searchChildren(self, connection, resource_factory, parents):
+        """Return children of the parents or None if search is unsupported."""
+        parent_ids = set(parent.common.id for parent in parents)
+        url = "{}?parent_id__in={}".format(
+            self.SEARCH_URL, ",".join(str(parent_id) for parent_id in sorted(parent_ids))
+        )
+        try:
+            children_json = connection.get(url)
+            children = [
+                resource_factory.get_resource_by_json(child_json)
+                for child_json in children_json
+            ]
+        except Exception as error:
+            log("Resource search by parent failed, falling back to listing: {}".format(error))
+            return None
+
+        # Servers without the filter ignore it and return unrelated resources
+        for child in children:
+            if child.common.parent is None or child.common.parent.id not in parent_ids:
+                log("Resource search by parent is not supported, falling back to listing")
+                self.search_supported = False
+                return None
+
+        return children
+
+    def __probeSearch(self, connection):
+        """Check that the search filters by parents, return None if unknown.
+
+        No resource has the parent -1, so a server that supports the filter
+        returns nothing. Other servers return the resource with the id.
+        """
+        url = "{}?id={}&parent_id__in=-1".format(self.SEARCH_URL, self.ngw_resource.common.id)
+        try:
+            resources_json = connection.get(url)
+        except Exception as error:
+            log("Failed to check resource search by parent: {}".format(error))
+            return None
+        return len(resources_json) == 0
+
+    def __isCancelled(self):
+        token = getattr(self, "cancellation_token", None)
+        return token is not None and token.isCancelled()
+
+
+class NGWVersionProbe(NGWResourceModelJob):
+    """Requests the version of the NGW server."""
+
+    def __init__(self, ngw_connection):
+        super().__init__()
+        self.ngw_connection = ngw_connection
+        self.version = None
+
+    def _do(self):
+        self.version = self.ngw_connection.get_version()
+
+
+class NGWResourceCopier(QGISResourceJob):
+    """Copies a vector or raster layer with its QML styles.
+
+    Layer data is downloaded to a temporary file and imported next to the
+    source. Vector layers are exported as GeoPackage, so features are read
+    from disk by OGR instead of being parsed from GeoJSON in memory. If
+    the server can't export GeoPackage, the GeoJSON of the layer is used.
+    Styles are uploaded from the style cache, a style that fails is
+    reported as a warning.
+    """
+
+    VECTOR_EXPORT_URL = "{}/export?format=GPKG&zipped=false"
+    RASTER_DOWNLOAD_URL = "{}/download"
+
+    progressChanged = pyqtSignal(object, object)
+
+    supports_cancellation = True
+
+    def __init__(self, ngw_resource, ngw_session, style_cache):
+        super().__init__()
+        self.ngw_resource = ngw_resource
+        self.ngw_session = ngw_session
+        self.style_cache = style_cache
+
+    def _do(self):
+        ngw_src = self.ngw_resource
+        display_name = ngw_src.common.display_name
+
+        ngw_group = ngw_src.get_parent()
+        style_resources = [
+            child_resource for child_resource in ngw_src.get_children()
+            if child_resource.type_id in (NGWQGISVectorStyle.type_id, NGWQGISRasterStyle.type_id)
+        ]
+        if self.__isCancelled():
+            return
+
+        source_path = None
+        if ngw_src.type_id == NGWVectorLayer.type_id:
+            self.statusChanged.emit('"{}" - Downloading features'.format(display_name))
+            # Export is built on request, ranges would build it for each chunk
+            source_path = self.__downloadSource(
+                self.VECTOR_EXPORT_URL.format(ngw_src.get_absolute_api_url()), ".gpkg",
+                required=False, ranged=False
+            )
+            if self.__isCancelled():
+                if source_path is not None:
+                    self.__removeFile(source_path)
+                return
+
+            qgs_layer = None
+            if source_path is not None:
+                qgs_layer = QgsVectorLayer(source_path, display_name, 'ogr')
+                if not qgs_layer.isValid():
+                    log('Exported GeoPackage of "{}" can\'t be read, GeoJSON is used'.format(display_name))
+                    del qgs_layer
+                    qgs_layer = None
+                    self.__removeFile(source_path)
+                    source_path = None
+            if qgs_layer is None:
+                qgs_layer = QgsVectorLayer(ngw_src.get_absolute_geojson_url(), display_name, 'ogr')
+                if qgs_layer.isValid():
+                    qgs_layer.dataProvider().setEncoding('UTF-8')
+        elif ngw_src.type_id == NGWRasterLayer.type_id:
+            self.statusChanged.emit('"{}" - Downloading raster'.format(display_name))
+            source_path = self.__downloadSource(
+                self.RASTER_DOWNLOAD_URL.format(ngw_src.get_absolute_api_url())
+            )
+            if source_path is None:
+                return
+            qgs_layer = QgsRasterLayer(source_path, display_name, 'gdal')
+        else:
+            raise JobError('Wrong layer type! Type id: {}'.format(ngw_src.type_id))
+
+        try:
+            if not qgs_layer.isValid():
+                raise JobError('Layer "{}" can\'t be added to the map!'.format(display_name))
+            if self.__isCancelled():
+                return
+
+            self.statusChanged.emit('"{}" - Uploading'.format(display_name))
+            try:
+                ngw_res = self.importQGISMapLayer(qgs_layer, ngw_group)[0]
+            except UnsupportedRasterTypeException as error:
+                raise JobError('This type of raster is not supported yet', error)
+        finally:
+            del qgs_layer
+            if source_path is not None:
+                self.__removeFile(source_path)
+
+        self.result.putAddedResource(ngw_res, is_main=True)
+
+        for style_resource in style_resources:
+            if self.__isCancelled():
+                break
+            style_request = self.style_cache.fetch(self.ngw_session, style_resource)
+            if not style_request.wait():
+                self.warningOccurred.emit(JobWarning(style_request.error()))
+                continue
+
+            def qml_callback(total_size, readed_size):
+                self.statusChanged.emit('Style for "{}" - Upload ({}%)'.format(
+                    display_name, int(readed_size * 100 / total_size)
+                ))
+
+            ngw_res.create_qml_style(
+                style_request.filePath(),
+                qml_callback,
+                style_name=style_resource.common.display_name
+            )
+        ngw_res.update()
+
+    def __downloadSource(self, url, suffix="", required=True, ranged=True):
+        """Download layer data to a temporary file, return its path.
+
+        None is returned if the job is cancelled, or if the download fails
+        and it is not required.
+        """
+        temp_file = QTemporaryFile(os.path.join(QDir.tempPath(), "ngw_copy_XXXXXX" + suffix))
+        temp_file.setAutoRemove(False)
+        if not temp_file.open():
+            raise JobError("Can't open file to write layer data!")
+        source_path = temp_file.fileName()
+        temp_file.close()
+
+        downloader = NGWDownloader(
+            self.ngw_session, url, source_path, self.ngw_resource.get_creds(), ranged
+        )
+        downloader.progressChanged.connect(self.__onDownloadProgress)
+        downloader.start()
+        if downloader.wait():
+            return source_path
+
+        self.__removeFile(source_path)
+        if self.__isCancelled():
+            return None
+        if not required:
+            log('Optional download of {} failed: {}'.format(url, downloader.error()))
+            return None
+        raise JobError('Failed to download layer data: {}'.format(downloader.error()))
+
+    def __onDownloadProgress(self, done, total):
+        self.progressChanged.emit(done, total)
+        if self.__isCancelled():
+            # Replies are not aborted from their own signal handlers
+            QTimer.singleShot(0, self.sender().abort)
+
+    def __removeFile(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def __isCancelled(self):
+        token = getattr(self, "cancellation_token", None)
+        return token is not None and token.isCancelled()
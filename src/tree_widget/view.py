@@ -1,12 +1,29 @@
-from qgis.PyQt.QtCore import Qt, pyqtSignal
+from qgis.PyQt.QtCore import QPoint, Qt, QTimer, pyqtSignal
 from qgis.PyQt.QtGui import QBrush, QColor, QPalette, QPainter, QPen
 from qgis.PyQt.QtWidgets import (
-    QHeaderView, QHBoxLayout, QLabel, QProgressBar, QSizePolicy, QSpacerItem, QTreeView,
-    QVBoxLayout, QWidget,
+    QAbstractItemView, QHeaderView, QHBoxLayout, QLabel, QProgressBar, QPushButton, QSizePolicy,
+    QSpacerItem, QTreeView, QTreeWidget, QTreeWidgetItem, QVBoxLayout, QWidget,
 )
 
+from .job_status import NGWJobStatusAggregator
 
-__all__ = ["QNGWResourceTreeView"]
+
+__all__ = ["QJobDashboard", "QNGWResourceTreeView"]
+
+
+def format_rate(bytes_per_second):
+    for unit in ("B/s", "KB/s", "MB/s"):
+        if bytes_per_second < 1024:
+            return "{:.0f} {}".format(bytes_per_second, unit)
+        bytes_per_second /= 1024
+    return "{:.1f} GB/s".format(bytes_per_second)
+
+
+def format_duration(seconds):
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return "{}:{:02d}:{:02d}".format(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+    return "{}:{:02d}".format(seconds // 60, seconds % 60)
 
 
 class QOverlay(QWidget):
@@ -37,6 +54,100 @@ class QMessageOverlay(QOverlay):
         self.layout.addWidget(self.text)
 
 
+class QJobDashboard(QWidget):
+    """Table of jobs with their state, progress, transfer rate and ETA.
+
+    Every job has its own Cancel button, it is disabled for jobs that
+    can't be cancelled. Queue metrics of the scheduler are shown below.
+    """
+
+    cancelRequested = pyqtSignal(object)
+
+    CancelColumn = 5
+
+    def __init__(self, parent):
+        super().__init__(parent)
+        self.layout = QVBoxLayout(self)
+        self.layout.setContentsMargins(0, 0, 0, 0)
+        self.setLayout(self.layout)
+
+        self.table = QTreeWidget(self)
+        self.table.setRootIsDecorated(False)
+        self.table.setSelectionMode(QAbstractItemView.NoSelection)
+        self.table.setFocusPolicy(Qt.NoFocus)
+        self.table.setHeaderLabels([
+            self.tr("Job"), self.tr("State"), self.tr("Progress"), self.tr("Speed"), self.tr("ETA"), "",
+        ])
+        header = self.table.header()
+        header.setStretchLastSection(False)
+        header.setSectionResizeMode(QHeaderView.ResizeToContents)
+        header.setSectionResizeMode(0, QHeaderView.Stretch)
+        self.layout.addWidget(self.table)
+
+        self.metrics_label = QLabel(self)
+        self.layout.addWidget(self.metrics_label)
+
+        self.__jobs = []
+
+    def setJobs(self, jobs):
+        """Show jobs given as (title, job state) pairs."""
+        self.__jobs = [job for _, job in jobs]
+
+        table = self.table
+        while table.topLevelItemCount() > len(jobs):
+            table.takeTopLevelItem(table.topLevelItemCount() - 1)
+        while table.topLevelItemCount() < len(jobs):
+            item = QTreeWidgetItem()
+            table.addTopLevelItem(item)
+            cancel_button = QPushButton(self.tr("Cancel"), table)
+            cancel_button.clicked.connect(lambda _, item=item: self.__cancelItemJob(item))
+            table.setItemWidget(item, self.CancelColumn, cancel_button)
+
+        for row, (title, job) in enumerate(jobs):
+            item = table.topLevelItem(row)
+            item.setText(0, title)
+            item.setToolTip(0, job["status"])
+            item.setText(1, self.__stateText(job))
+            item.setText(2, "" if job["percent"] is None else "{:.0f}%".format(job["percent"]))
+            item.setText(3, "" if job["rate"] is None else format_rate(job["rate"]))
+            item.setText(4, "" if job["eta"] is None else format_duration(job["eta"]))
+
+            cancel_button = table.itemWidget(item, self.CancelColumn)
+            cancel_button.setEnabled(job["cancellable"])
+            cancel_button.setToolTip(
+                "" if job["cancellable"] or job["state"] != NGWJobStatusAggregator.StateRunning
+                else self.tr("This operation can't be cancelled")
+            )
+
+    def setMetrics(self, metrics):
+        """Show metrics of NGWJobScheduler."""
+        self.metrics_label.setText(
+            self.tr("Running: {} of {}, queued: {}, average wait: {}, max wait: {}").format(
+                metrics["running"],
+                metrics["max_concurrency"],
+                metrics["queue_depth"],
+                format_duration(metrics["average_wait"]),
+                format_duration(metrics["max_wait"]),
+            )
+        )
+
+    def __cancelItemJob(self, item):
+        row = self.table.indexOfTopLevelItem(item)
+        if 0 <= row < len(self.__jobs) and self.__jobs[row]["cancellable"]:
+            self.cancelRequested.emit(self.__jobs[row]["job"])
+
+    def __stateText(self, job):
+        if job["state"] == NGWJobStatusAggregator.StateQueued:
+            return self.tr("Queued")
+        if job["state"] == NGWJobStatusAggregator.StateCancelling:
+            return self.tr("Cancelling")
+        if job["state"] == NGWJobStatusAggregator.StateCancelled:
+            return self.tr("Cancelled")
+        if job["status"] != "":
+            return job["status"]
+        return self.tr("Running")
+
+
 class QProcessOverlay(QOverlay):
     def __init__(self, parent):
         super().__init__(parent)
@@ -75,15 +186,6 @@ class QProcessOverlay(QOverlay):
         self.text.setWordWrap(True)
         self.central_widget_layout.addWidget(self.text)
 
-    def write(self, jobs):
-        text = ""
-        for job_name, job_status in list(jobs.items()):
-            text += "<strong>%s</strong><br/>" % job_name
-            if job_status != "":
-                text += "%s<br/>" % job_status
-
-        self.text.setText(text)
-
 
 class QNGWResourceTreeView(QTreeView):
     itemDoubleClicked = pyqtSignal(object)
@@ -109,11 +211,21 @@ class QNGWResourceTreeView(QTreeView):
         self.ngw_job_block_overlay = QProcessOverlay(self)
         self.ngw_job_block_overlay.hide()
 
-        self.jobs = {}
+        # Large groups are loaded by pages while their last rows are visible
+        self.__fetch_more_timer = QTimer(self)
+        self.__fetch_more_timer.setSingleShot(True)
+        self.__fetch_more_timer.setInterval(0)
+        self.__fetch_more_timer.timeout.connect(self.__fetchMoreForVisibleRows)
+        self.verticalScrollBar().valueChanged.connect(self.__fetch_more_timer.start)
+        self.expanded.connect(self.__fetch_more_timer.start)
 
     def setModel(self, model):
         self._source_model = model
         self._source_model.rowsInserted.connect(self.__insertRowsProcess)
+        self._source_model.rowsInserted.connect(self.__fetch_more_timer.start)
+        # Deletions change flags of whole subtrees
+        self._source_model.indexesLocked.connect(self.viewport().update)
+        self._source_model.indexesUnlocked.connect(self.viewport().update)
 
         super().setModel(self._source_model)
 
@@ -128,11 +240,32 @@ class QNGWResourceTreeView(QTreeView):
         #         parent
         #     )
 
+    def __fetchMoreForVisibleRows(self):
+        model = self.model()
+        if model is None:
+            return
+
+        # A page that doesn't fill the viewport leaves its last row visible
+        viewport_height = self.viewport().height()
+        index = self.indexAt(QPoint(0, 0))
+        while index.isValid() and self.visualRect(index).top() < viewport_height:
+            last_index = index
+            while last_index.isValid():
+                parent = last_index.parent()
+                if last_index.row() != model.rowCount(parent) - 1:
+                    break
+                if model.canFetchMore(parent):
+                    model.fetchMore(parent)
+                    return
+                last_index = parent
+            index = self.indexBelow(index)
+
     def resizeEvent(self, event):
         self.no_ngw_connections_overlay.resize(event.size())
         self.ngw_job_block_overlay.resize(event.size())
 
         QTreeView.resizeEvent(self, event)
+        self.__fetch_more_timer.start()
 
     def mouseDoubleClickEvent(self, e):
         index = self.indexAt(e.pos())
@@ -146,24 +279,3 @@ class QNGWResourceTreeView(QTreeView):
 
     def hideWelcomeMessage(self):
         self.no_ngw_connections_overlay.hide()
-
-    def addBlockedJob(self, job_name):
-        self.jobs.update(
-            {job_name: ""}
-        )
-        self.ngw_job_block_overlay.write(self.jobs)
-
-        self.ngw_job_block_overlay.show()
-
-    def addJobStatus(self, job_name, status):
-        if job_name in self.jobs:
-            self.jobs[job_name] = status
-            self.ngw_job_block_overlay.write(self.jobs)
-
-    def removeBlockedJob(self, job_name):
-        if job_name in self.jobs:
-            self.jobs.pop(job_name)
-            self.ngw_job_block_overlay.write(self.jobs)
-
-        if len(self.jobs) == 0:
-            self.ngw_job_block_overlay.hide()